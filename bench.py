@@ -0,0 +1,93 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+from load import Loader
+from synthetic import SyntheticSurvey
+from writer import WRITERS
+
+# 比較するロード方式（Loaderの引数）
+STRATEGIES = [
+    *[{"method": method, "transform": transform} for method in WRITERS.keys() for transform in Loader.TRANSFORMS],
+    {"method": "copy_binary", "transform": "rows", "staging": True},
+    # 書き込みスレッドとパース用のワーカープロセス
+    {"method": "copy_binary", "transform": "rows", "writer_threads": 2},
+    {"method": "copy_binary", "transform": "rows", "parse_workers": 2},
+]
+
+
+def _run(csv_dir: str, survey_number: int, strategy: dict, batch_size: int) -> dict:
+    # 方式ごとに新しいプロセスで実行し、そのプロセスの最大RSSを計測する
+    os.environ["CSV_DIR"] = csv_dir
+    summary = Loader(batch_size=batch_size, **strategy).load(survey_number)
+    # parse_workersのワーカープロセスは終了済みなので、RUSAGE_CHILDRENでそのうち最大のRSSを取れる
+    summary["peak_rss_bytes"] = _peak_rss(resource.RUSAGE_SELF)
+    summary["peak_worker_rss_bytes"] = _peak_rss(resource.RUSAGE_CHILDREN)
+    return summary
+
+
+def _peak_rss(who: int) -> int:
+    # ru_maxrssはLinuxではKB、macOSではバイト
+    peak_rss = resource.getrusage(who).ru_maxrss
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def run(csv_dir: str, survey_number: int, strategies: list, batch_size: int) -> list:
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for strategy in strategies:
+        with context.Pool(1) as pool:
+            summary = pool.apply(_run, (csv_dir, survey_number, strategy, batch_size))
+        results.append({
+            "strategy": strategy,
+            "rows": summary["count"],
+            "seconds": summary["seconds"],
+            "rows_per_second": summary["count"] / summary["seconds"] if summary["seconds"] > 0 else None,
+            "db_seconds": summary["write_seconds"],
+            "lock_seconds": summary["lock_seconds"],
+            "peak_rss_bytes": summary["peak_rss_bytes"],
+            "peak_worker_rss_bytes": summary["peak_worker_rss_bytes"],
+        })
+        print(json.dumps(results[-1]))
+    return results
+
+
+def main(args):
+    """
+    メイン関数（接続先のDBの指定した調査の回答は、各方式のロードで置き換わる）
+    """
+    parser = argparse.ArgumentParser(prog=args[0])
+    parser.add_argument("directory", help="合成したCSVを置くディレクトリ")
+    parser.add_argument("--survey", type=int, default=next(iter(Loader.KEY_DICT_BY_SURVEY)), help="調査番号")
+    parser.add_argument("--rows", type=int, default=10000, help="合成する行数（既にCSVがあれば合成しない）")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--output", default="bench_output.json", help="結果のJSONの出力先")
+    options = parser.parse_args(args[1:])
+
+    # 合成データを用意
+    path = os.path.join(options.directory, str(options.survey) + ".csv")
+    if not os.path.exists(path):
+        os.makedirs(options.directory, exist_ok=True)
+        SyntheticSurvey(options.survey).write(path, options.rows)
+
+    started = time.time()
+    results = run(os.path.join(options.directory, ""), options.survey, STRATEGIES, options.batch_size)
+    report = {
+        "survey_number": options.survey,
+        "csv": path,
+        "csv_bytes": os.path.getsize(path),
+        "batch_size": options.batch_size,
+        "started_at": started,
+        "results": results,
+    }
+    with open(options.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print("report: " + options.output)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
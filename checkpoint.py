@@ -0,0 +1,31 @@
+import datetime
+
+from migrate import LoadCheckpoint
+from manifest import Fingerprint
+
+
+def find(session, survey_number: int, fingerprint: Fingerprint, version: str):
+    # 同じ内容のファイルと同じマッピングでのロード途中の位置（なければNone）
+    checkpoint = session.get(LoadCheckpoint, survey_number)
+    if checkpoint is None or checkpoint.mapping_version != version \
+            or checkpoint.content_hash != fingerprint.content_hash:
+        return None
+    return checkpoint
+
+
+def save(session, survey_number: int, fingerprint: Fingerprint, version: str, byte_offset: int,
+         last_answer_key: int, row_count: int) -> None:
+    # バッチと同じトランザクションで記録する（コミットされた位置とDBの行が必ず一致する）
+    session.merge(LoadCheckpoint(
+        survey_number=survey_number,
+        content_hash=fingerprint.content_hash,
+        mapping_version=version,
+        byte_offset=byte_offset,
+        last_answer_key=last_answer_key,
+        row_count=row_count,
+        updated_at=datetime.datetime.now(),
+    ))
+
+
+def clear(session, survey_number: int) -> None:
+    session.query(LoadCheckpoint).filter(LoadCheckpoint.survey_number == survey_number).delete()
@@ -0,0 +1,163 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from migrate import Answer, DeferredDefinition
+from setting import maintenance_statement_timeout
+
+
+class DeferredConstraints:
+    """
+    大量ロードの間だけanswers_factの外部キー・一意制約・副次索引を外し、ロード後に作り直す
+    """
+
+    def __init__(self, engine, workers: int = 4):
+        self.engine = engine
+        self.workers = workers
+        self.table = Answer.__tablename__
+        self.constraints = []
+        self.indexes = []
+        self.timings = {}
+
+    @contextmanager
+    def begin(self):
+        # 索引の作成や制約の検証は通常の文のタイムアウトより長くかかるので、トランザクションの間だけ設定し直す
+        with self.engine.begin() as connection:
+            connection.execute(text("SET LOCAL statement_timeout = %d" % maintenance_statement_timeout()))
+            yield connection
+
+    def partitions(self, connection) -> list:
+        return connection.execute(text(
+            "SELECT CAST(CAST(inhrelid AS regclass) AS text) FROM pg_inherits "
+            "WHERE inhparent = CAST(:table AS regclass) ORDER BY 1"
+        ), {"table": self.table}).scalars().all()
+
+    def saved(self, connection) -> tuple:
+        # 外したまま作り直していない制約と索引の定義
+        rows = connection.execute(select(DeferredDefinition.name, DeferredDefinition.kind,
+                                         DeferredDefinition.definition)
+                                  .where(DeferredDefinition.table_name == self.table)
+                                  .order_by(DeferredDefinition.name)).all()
+        return ([tuple(row) for row in rows if row.kind != "i"],
+                [(row.name, row.definition) for row in rows if row.kind == "i"])
+
+    def pending(self) -> bool:
+        # 前回のロードが制約を作り直す前に止まっていればTrue
+        with self.engine.connect() as connection:
+            return any(self.saved(connection))
+
+    def drop(self) -> None:
+        started = time.perf_counter()
+        with self.begin() as connection:
+            # 外部キーと一意制約（主キーは残す）
+            constraints = connection.execute(text(
+                "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+                "WHERE conrelid = CAST(:table AS regclass) AND contype IN ('f', 'u') ORDER BY conname"
+            ), {"table": self.table}).all()
+
+            # 制約に紐づかない索引
+            indexes = connection.execute(text(
+                "SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i "
+                "JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE i.indrelid = CAST(:table AS regclass) "
+                "AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = i.indexrelid) ORDER BY 1"
+            ), {"table": self.table}).all()
+
+            # 外す前に定義を保存する（作り直す前に止まっても次のロードで作り直せる）
+            rows = ([{"table_name": self.table, "name": name, "kind": kind, "definition": definition}
+                     for name, kind, definition in constraints]
+                    + [{"table_name": self.table, "name": name, "kind": "i", "definition": definition}
+                       for name, definition in indexes])
+            if rows:
+                connection.execute(insert(DeferredDefinition).values(rows).on_conflict_do_nothing())
+
+            for name, _, _ in constraints:
+                connection.execute(text('ALTER TABLE %s DROP CONSTRAINT "%s"' % (self.table, name)))
+            for name, _ in indexes:
+                connection.execute(text('DROP INDEX "%s"' % name))
+            self.drop_detached(connection)
+            self.constraints, self.indexes = self.saved(connection)
+        self.timings["drop"] = time.perf_counter() - started
+
+    def drop_detached(self, connection) -> None:
+        # 親に付け替えられないまま残ったパーティションの制約と索引（作り直しの途中で止まった分）を外す
+        partitions = self.partitions(connection)
+        for partition in partitions:
+            names = connection.execute(text(
+                "SELECT conname FROM pg_constraint WHERE conrelid = CAST(:partition AS regclass) "
+                "AND contype IN ('f', 'u') AND conparentid = 0 ORDER BY 1"
+            ), {"partition": partition}).scalars().all()
+            for name in names:
+                connection.execute(text('ALTER TABLE %s DROP CONSTRAINT "%s"' % (partition, name)))
+            names = connection.execute(text(
+                "SELECT CAST(CAST(i.indexrelid AS regclass) AS text) FROM pg_index i "
+                "WHERE i.indrelid = CAST(:partition AS regclass) "
+                "AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = i.indexrelid) "
+                "AND NOT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = i.indexrelid) ORDER BY 1"
+            ), {"partition": partition}).scalars().all()
+            for name in names:
+                connection.execute(text("DROP INDEX " + name))
+
+    def restore(self) -> None:
+        with self.engine.connect() as connection:
+            partitions = self.partitions(connection)
+            self.constraints, self.indexes = self.saved(connection)
+
+        # 一意制約と索引はパーティションごとに並列で作成し、最後に親へ付け替える
+        started = time.perf_counter()
+        unique = [(name, definition) for name, kind, definition in self.constraints if kind == "u"]
+        statements = []
+        for partition in partitions:
+            for name, definition in unique:
+                statements.append(['ALTER TABLE %s ADD CONSTRAINT "%s_%s" %s' % (partition, partition, name, definition)])
+            for name, definition in self.indexes:
+                statements.append([re.sub(r"^(CREATE (?:UNIQUE )?INDEX) \S+ ON (?:ONLY )?\S+",
+                                          r"\1 ON " + partition, definition)])
+        self.run_parallel(statements)
+        with self.begin() as connection:
+            for name, definition in unique:
+                connection.execute(text('ALTER TABLE %s ADD CONSTRAINT "%s" %s' % (self.table, name, definition)))
+            for name, definition in self.indexes:
+                # ONLYを付けると親の索引が無効なまま残るので、付けずにパーティションの索引を付け替えさせる
+                connection.execute(text(definition.replace(" ON ONLY ", " ON ", 1)))
+        self.timings["indexes"] = time.perf_counter() - started
+
+        # 外部キーはパーティションごとにNOT VALIDで追加してから並列に検証し、最後に親へ付け替える
+        started = time.perf_counter()
+        foreign_keys = [(name, definition) for name, kind, definition in self.constraints if kind == "f"]
+        with self.begin() as connection:
+            for partition in partitions:
+                for name, definition in foreign_keys:
+                    connection.execute(text('ALTER TABLE %s ADD CONSTRAINT "%s_%s" %s NOT VALID'
+                                            % (partition, partition, name, definition)))
+        self.run_parallel([['ALTER TABLE %s VALIDATE CONSTRAINT "%s_%s"' % (partition, partition, name)
+                            for name, _ in foreign_keys] for partition in partitions])
+        with self.begin() as connection:
+            for name, definition in foreign_keys:
+                connection.execute(text('ALTER TABLE %s ADD CONSTRAINT "%s" %s' % (self.table, name, definition)))
+            # 全て作り直したので保存しておいた定義を消す
+            connection.execute(delete(DeferredDefinition).where(DeferredDefinition.table_name == self.table))
+        self.timings["foreign_keys"] = time.perf_counter() - started
+
+        # 統計情報を更新
+        started = time.perf_counter()
+        with self.begin() as connection:
+            connection.execute(text("ANALYZE " + self.table))
+        self.timings["analyze"] = time.perf_counter() - started
+
+    def run_parallel(self, statement_groups: list) -> None:
+        # グループごとに別の接続で実行（同じグループ内は順に実行）
+        def run(statements):
+            with self.begin() as connection:
+                connection.execute(text("SET LOCAL max_parallel_maintenance_workers = %d" % self.workers))
+                for statement in statements:
+                    connection.execute(text(statement))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(run, statement_groups))
+
+    def print_timings(self) -> None:
+        print(", ".join("%s seconds: %s" % (phase, round(seconds, 2)) for phase, seconds in self.timings.items()))
@@ -0,0 +1,251 @@
+import argparse
+import sys
+import time
+from typing import NamedTuple
+import numpy as np
+import pyarrow.dataset as ds
+from sqlalchemy import String, select
+
+from migrate import Answer, Survey
+from rollup import INCOME_BOUNDS
+from setting import Engine
+from writer import ANSWER_COLUMNS, ANSWER_FIELDS
+
+# キューブに持つ既定の次元（次元を増やすとセルの数は各次元のキーの数の積で増える）
+DEFAULT_DIMENSIONS = ("survey_number", "industry", "company_size", "age_class")
+
+# 外部キーを持つ属性（キューブの次元にできる）とその参照先の列
+DIMENSION_COLUMNS = {field: next(iter(column.foreign_keys)).column
+                     for field, column in zip(ANSWER_FIELDS, ANSWER_COLUMNS) if column.foreign_keys}
+
+# 密な配列にするセルの数の上限（年収の階級ごとの件数も持つので、1セルあたり約300バイト）
+MAX_CELLS = 1 << 20
+
+# 年収の階級ごとの下限と上限（最後の階級は上限なしなので下限を返す）
+_LOWER = np.array([0, *INCOME_BOUNDS], dtype=np.float64)
+_UPPER = np.array([*INCOME_BOUNDS, INCOME_BOUNDS[-1]], dtype=np.float64)
+
+
+def _label_column(target):
+    # 次元テーブルの表示名の列（調査は調査年、それ以外は最初の文字列の列）
+    if target.table is Survey.__table__:
+        return Survey.__table__.c.year
+    return next(column for column in target.table.columns if isinstance(column.type, String))
+
+
+def income_quantiles(histogram: np.ndarray, q: float) -> np.ndarray:
+    """
+    rollup.income_quantileを最後の軸（年収の階級）についてまとめて求める（件数0のセルはNaN）
+    """
+    counts = histogram.astype(np.float64)
+    total = counts.sum(axis=-1)
+    cumulative = np.cumsum(counts, axis=-1)
+    target = q * total
+    bucket = np.argmax((cumulative >= target[..., None]) & (counts > 0), axis=-1)
+    count = np.take_along_axis(counts, bucket[..., None], axis=-1)[..., 0]
+    before = np.take_along_axis(cumulative, bucket[..., None], axis=-1)[..., 0] - count
+    lower = _LOWER[bucket]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = lower + (_UPPER[bucket] - lower) * (target - before) / count
+    return np.where(total > 0, result, np.nan)
+
+
+class Crosstab(NamedTuple):
+    """
+    クロス集計の結果（各配列の軸はdimensionsの並び、キー0は未回答）
+    """
+    dimensions: tuple
+    keys: list
+    labels: list
+    counts: np.ndarray
+    income_sum: np.ndarray
+    histogram: np.ndarray
+
+    def income_mean(self) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.counts > 0, self.income_sum / self.counts, np.nan)
+
+    def income_quantile(self, q: float) -> np.ndarray:
+        if self.histogram is None:
+            raise ValueError("crosstab was computed without histogram")
+        return income_quantiles(self.histogram, q)
+
+
+class Cube:
+    """
+    回答を次元の組ごとに集計した密なNumPy配列（件数・年収の合計・年収の階級ごとの件数）
+    次元のキーは0（未回答）から始まる添字で持ち、クロス集計は残りの軸を足し合わせるだけで求める
+    """
+
+    def __init__(self, dimensions: tuple, keys: dict, labels: dict):
+        unknown = [dimension for dimension in dimensions if dimension not in DIMENSION_COLUMNS]
+        if unknown:
+            raise ValueError("unknown dimensions: %s" % ", ".join(unknown))
+        self.dimensions = tuple(dimensions)
+        self.keys = {dimension: np.asarray(keys[dimension], dtype=np.int64) for dimension in self.dimensions}
+        self.labels = labels
+        self.shape = tuple(len(self.keys[dimension]) for dimension in self.dimensions)
+        cells = int(np.prod(self.shape, dtype=np.int64))
+        if cells > MAX_CELLS:
+            raise ValueError("cube of %s has %d cells, use fewer dimensions" % (", ".join(self.dimensions), cells))
+        self.counts = np.zeros(self.shape, dtype=np.int64)
+        self.income_sum = np.zeros(self.shape, dtype=np.float64)
+        self.histogram = np.zeros(self.shape + (len(INCOME_BOUNDS) + 1,), dtype=np.int64)
+
+    @classmethod
+    def empty(cls, connection, dimensions: tuple = DEFAULT_DIMENSIONS):
+        # 各次元のキー（先頭に未回答の0）と表示名を次元テーブルから読み込む
+        keys = {}
+        labels = {}
+        for dimension in dimensions:
+            target = DIMENSION_COLUMNS[dimension]
+            rows = connection.execute(select(target, _label_column(target)).order_by(target)).all()
+            keys[dimension] = [0, *(key for key, _ in rows if key != 0)]
+            labels[dimension] = {0: None, **dict(rows)}
+        return cls(dimensions, keys, labels)
+
+    def add(self, columns: dict, income: np.ndarray) -> None:
+        """
+        回答のまとまりを足し込む
+        columns: 次元 → キーの配列（NULLはNaN）、income: 主な仕事の年収（NULLはNaN）
+        """
+        codes = []
+        for dimension in self.dimensions:
+            values = np.nan_to_num(np.asarray(columns[dimension], dtype=np.float64)).astype(np.int64)
+            keys = self.keys[dimension]
+            code = np.clip(np.searchsorted(keys, values), 0, len(keys) - 1)
+            # 次元テーブルにないキーは未回答として数える
+            code[keys[code] != values] = 0
+            codes.append(code)
+        cell = np.ravel_multi_index(codes, self.shape) if codes else np.zeros(len(income), dtype=np.int64)
+        income = np.nan_to_num(np.asarray(income, dtype=np.float64))
+        # width_bucketと同じく、境界以上の最後の階級
+        bucket = np.searchsorted(INCOME_BOUNDS, income, side="right")
+        size = self.counts.size
+        self.counts += np.bincount(cell, minlength=size).reshape(self.shape)
+        self.income_sum += np.bincount(cell, weights=income, minlength=size).reshape(self.shape)
+        buckets = self.histogram.shape[-1]
+        self.histogram += np.bincount(cell * buckets + bucket, minlength=size * buckets).reshape(self.histogram.shape)
+
+    @classmethod
+    def from_db(cls, dimensions: tuple = DEFAULT_DIMENSIONS, survey_numbers: list = None,
+                batch_size: int = 100000):
+        """
+        answers_factを1回走査してキューブを作る
+        """
+        fields = [*dimensions, "main_job_income"]
+        statement = select(*[getattr(Answer, field) for field in fields])
+        if survey_numbers:
+            statement = statement.where(Answer.survey_number.in_(survey_numbers))
+        with Engine.connect() as connection:
+            cube = cls.empty(connection, dimensions)
+            result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(statement)
+            for rows in result.partitions():
+                # NoneはNaNになる
+                values = np.array(rows, dtype=np.float64).reshape(len(rows), len(fields))
+                cube.add({dimension: values[:, index] for index, dimension in enumerate(dimensions)}, values[:, -1])
+        return cube
+
+    @classmethod
+    def from_parquet(cls, directory: str, dimensions: tuple = DEFAULT_DIMENSIONS, survey_numbers: list = None):
+        """
+        export.pyのParquetのスナップショットからキューブを作る（次元のキーと表示名はDBの次元テーブルから）
+        """
+        dataset = ds.dataset(directory, format="parquet", partitioning="hive")
+        names = {field: Answer.__mapper__.get_property(field).columns[0].name for field in dimensions}
+        condition = ds.field("survey_number").isin(survey_numbers) if survey_numbers else None
+        with Engine.connect() as connection:
+            cube = cls.empty(connection, dimensions)
+        for batch in dataset.to_batches(columns=[*names.values(), "main_job_income"], filter=condition):
+            # NULLを含む整数の列はNaNを含む浮動小数点数になる
+            cube.add({field: batch.column(name).to_numpy(zero_copy_only=False) for field, name in names.items()},
+                     batch.column("main_job_income").to_numpy(zero_copy_only=False))
+        return cube
+
+    def _selection(self, filters: dict) -> list:
+        # 軸ごとに残すキーの添字（指定のない軸は全て）
+        selection = [slice(None)] * len(self.dimensions)
+        for dimension, values in filters.items():
+            if dimension not in self.dimensions:
+                raise ValueError("cube has no dimension: %s" % dimension)
+            axis = self.dimensions.index(dimension)
+            keys = self.keys[dimension]
+            values = np.atleast_1d(np.asarray(values, dtype=np.int64))
+            index = np.searchsorted(keys, values)
+            selection[axis] = index[(index < len(keys)) & (keys[np.minimum(index, len(keys) - 1)] == values)]
+        return selection
+
+    def filter(self, **filters):
+        """
+        指定したキーだけに絞ったキューブ（filter(industry=[3, 5], survey_number=1523)のように指定）
+        """
+        selection = self._selection(filters)
+        cube = Cube.__new__(Cube)
+        cube.dimensions = self.dimensions
+        cube.labels = self.labels
+        cube.keys = {dimension: self.keys[dimension][index] for dimension, index in zip(self.dimensions, selection)}
+        cube.shape = tuple(len(cube.keys[dimension]) for dimension in self.dimensions)
+        index = np.ix_(*[np.arange(size)[axis] for size, axis in zip(self.shape, selection)])
+        cube.counts = self.counts[index]
+        cube.income_sum = self.income_sum[index]
+        cube.histogram = self.histogram[index]
+        return cube
+
+    def crosstab(self, *dimensions, histogram: bool = False, **filters) -> Crosstab:
+        """
+        指定した次元（1つならgroup-by）のクロス集計。残りの軸は足し合わせる
+        histogramを指定すると分位点のために年収の階級ごとの件数も集計する
+        """
+        cube = self.filter(**filters) if filters else self
+        axes = [cube.dimensions.index(dimension) for dimension in dimensions]
+        rest = tuple(axis for axis in range(len(cube.dimensions)) if axis not in axes)
+        # 残した軸を指定の並びにそろえる
+        order = np.argsort(np.argsort(axes)) if axes else []
+
+        def rollup(values: np.ndarray) -> np.ndarray:
+            values = values.sum(axis=rest)
+            return np.transpose(values, [*order, *range(len(axes), values.ndim)])
+
+        keys = [cube.keys[dimension] for dimension in dimensions]
+        return Crosstab(
+            dimensions=tuple(dimensions),
+            keys=keys,
+            labels=[[self.labels[dimension].get(key) for key in values.tolist()]
+                    for dimension, values in zip(dimensions, keys)],
+            counts=rollup(cube.counts),
+            income_sum=rollup(cube.income_sum),
+            histogram=rollup(cube.histogram) if histogram else None,
+        )
+
+
+def main(args):
+    """
+    メイン関数（指定した次元のクロス集計の件数と平均年収を出力）
+    """
+    parser = argparse.ArgumentParser(prog=args[0])
+    parser.add_argument("dimensions", nargs="+", choices=DIMENSION_COLUMNS.keys(), help="集計する次元")
+    parser.add_argument("--parquet", help="DBの代わりに読み込むParquetのデータセット（export.pyの出力先）")
+    parser.add_argument("--surveys", type=int, nargs="*", help="対象の調査番号")
+    options = parser.parse_args(args[1:])
+
+    dimensions = tuple(dict.fromkeys(options.dimensions))
+    started = time.perf_counter()
+    if options.parquet:
+        cube = Cube.from_parquet(options.parquet, dimensions, options.surveys)
+    else:
+        cube = Cube.from_db(dimensions, options.surveys)
+    loaded = time.perf_counter()
+    crosstab = cube.crosstab(*dimensions)
+    finished = time.perf_counter()
+
+    means = crosstab.income_mean()
+    for index in np.ndindex(crosstab.counts.shape):
+        if crosstab.counts[index]:
+            labels = [str(labels[position]) for labels, position in zip(crosstab.labels, index)]
+            print("\t".join([*labels, str(crosstab.counts[index]), str(round(means[index], 1))]))
+    print("cells: " + str(cube.counts.size) + ", load seconds: " + str(round(loaded - started, 2))
+          + ", crosstab ms: " + str(round((finished - loaded) * 1000, 3)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
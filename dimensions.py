@@ -0,0 +1,130 @@
+import bisect
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+
+from migrate import AgeClass
+from writer import ANSWER_COLUMNS, ANSWER_FIELDS
+
+_MIN = np.iinfo(np.int64).min
+_MAX = np.iinfo(np.int64).max
+
+
+def _half_open(age_range) -> tuple:
+    # INT4RANGEを[lower, upper)の整数区間にそろえる（上下限なしは最小値・最大値）
+    lower = _MIN if age_range.lower is None else age_range.lower + (0 if age_range.lower_inc else 1)
+    upper = _MAX if age_range.upper is None else age_range.upper + (1 if age_range.upper_inc else 0)
+    return lower, upper
+
+
+class AgeClassLookup:
+    """
+    年齢から年齢階級のキーを求める区間の表（age_classes_dimから作成、区間は重ならない前提）
+    """
+
+    def __init__(self, intervals: list):
+        intervals = sorted(intervals)
+        self.starts = np.array([lower for lower, _, _ in intervals], dtype=np.int64)
+        self.ends = np.array([upper for _, upper, _ in intervals], dtype=np.int64)
+        self.keys = np.array([key for _, _, key in intervals], dtype=np.int64)
+        self._starts = self.starts.tolist()
+        self._ends = self.ends.tolist()
+        self._keys = self.keys.tolist()
+
+    @classmethod
+    def load(cls, session):
+        return cls([(*_half_open(age_class.age_range), age_class.key)
+                    for age_class in session.query(AgeClass) if not age_class.age_range.isempty])
+
+    def lookup(self, age: int):
+        if age is None:
+            return None
+        index = bisect.bisect_right(self._starts, age) - 1
+        if index >= 0 and age < self._ends[index]:
+            return self._keys[index]
+        return None
+
+    def lookup_array(self, ages) -> pd.arrays.IntegerArray:
+        # 年齢の列（欠損はNA）をまとめて年齢階級のキーに変換
+        ages = pd.array(ages, dtype="Int64")
+        values = ages.to_numpy(dtype=np.int64, na_value=0)
+        index = np.searchsorted(self.starts, values, side="right") - 1
+        found = (index >= 0) & ~ages.isna()
+        index = np.clip(index, 0, max(len(self.keys) - 1, 0))
+        if len(self.keys):
+            found &= values < self.ends[index]
+            keys = self.keys[index]
+        else:
+            keys = np.zeros(len(values), dtype=np.int64)
+        return pd.arrays.IntegerArray(keys, ~found)
+
+
+class DimensionKeys:
+    """
+    回答の外部キーの参照先（*_dim）のキーの集合をビット列で持ち、書き込む前のバッチをまとめて検証する
+    """
+
+    def __init__(self, keys: dict):
+        # keys: 属性名 → (参照先のテーブル名, キーの並び)
+        self.tables = {}
+        self.bitsets = {}
+        for field, (table_name, values) in keys.items():
+            values = np.asarray(values, dtype=np.int64)
+            values = values[values >= 0]
+            bitset = np.zeros(values.max() + 1 if len(values) else 0, dtype=bool)
+            bitset[values] = True
+            self.tables[field] = table_name
+            self.bitsets[field] = bitset
+
+    @classmethod
+    def load(cls, session):
+        # ANSWER_FIELDSのうち外部キーを持つ属性ごとに参照先のキーを読み込む
+        keys = {}
+        for field, column in zip(ANSWER_FIELDS, ANSWER_COLUMNS):
+            for foreign_key in column.foreign_keys:
+                target = foreign_key.column
+                keys[field] = (target.table.name, session.execute(select(target)).scalars().all())
+        return cls(keys)
+
+    def missing(self, field: str, values: np.ndarray, null: np.ndarray) -> np.ndarray:
+        # 参照先にない値のマスク（NULLは外部キー制約に違反しない）
+        bitset = self.bitsets[field]
+        inside = (values >= 0) & (values < len(bitset)) & ~null
+        found = np.zeros(len(values), dtype=bool)
+        found[inside] = bitset[values[inside]]
+        return ~found & ~null
+
+    def check(self, columns: dict, size: int) -> tuple:
+        """
+        columns: 属性名 → (値の配列, NULLのマスク)
+        不正な行のマスクと、不正な行の位置 → 理由の並びを返す
+        """
+        rejected = np.zeros(size, dtype=bool)
+        reasons = {}
+        for field, (values, null) in columns.items():
+            missing = self.missing(field, values, null)
+            for index in np.flatnonzero(missing).tolist():
+                reasons.setdefault(index, []).append(
+                    "%s=%d not in %s" % (field, values[index], self.tables[field]))
+            rejected |= missing
+        return rejected, reasons
+
+    def check_rows(self, rows: list) -> tuple:
+        # 行タプル（並びはANSWER_FIELDS）のバッチを検証
+        columns = {}
+        for field in self.bitsets:
+            index = ANSWER_FIELDS.index(field)
+            values = np.array(list(map(itemgetter(index), rows)), dtype=object)
+            null = values == None  # noqa: E711（要素ごとの比較）
+            values[null] = -1
+            columns[field] = (values.astype(np.int64), null)
+        return self.check(columns, len(rows))
+
+    def check_frame(self, frame: pd.DataFrame) -> tuple:
+        # DataFrame（列はANSWER_FIELDS）のバッチを検証
+        columns = {}
+        for field in self.bitsets:
+            values = pd.array(frame[field], dtype="Int64")
+            columns[field] = (values.to_numpy(dtype=np.int64, na_value=-1), values.isna())
+        return self.check(columns, len(frame))
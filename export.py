@@ -0,0 +1,101 @@
+import os
+import sys
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import BigInteger, Boolean, Float, select
+
+from migrate import Answer, Survey
+from setting import Engine
+from writer import ANSWER_COLUMNS, ANSWER_FIELDS
+
+
+def _arrow_type(column):
+    # 次元のキーは小さい整数、それ以外は列の型に合わせる
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if column.foreign_keys or column.name in ("age", "gender", "children_count", "leaving_count"):
+        return pa.int16()
+    if isinstance(column.type, BigInteger):
+        return pa.int64()
+    return pa.int32()
+
+
+# survey_numberはディレクトリ名（survey_number=<調査番号>）に持たせる
+EXPORT_FIELDS = ANSWER_FIELDS[1:]
+EXPORT_SCHEMA = pa.schema([pa.field(column.name, _arrow_type(column)) for column in ANSWER_COLUMNS[1:]])
+
+# 次元のキーは辞書エンコードする
+DICTIONARY_COLUMNS = [column.name for column in ANSWER_COLUMNS[1:] if column.foreign_keys]
+
+
+class ParquetExporter:
+    """
+    調査ごとの回答をsurvey_numberでパーティション分割したParquetのデータセットに書き出す
+    """
+
+    def __init__(self, directory: str, survey_number: int):
+        self.directory = os.path.join(directory, "survey_number=%d" % survey_number)
+        self.path = os.path.join(self.directory, "part-0.parquet")
+        os.makedirs(self.directory, exist_ok=True)
+
+        # 書き終わるまでは一時ファイルに書き、完了したら置き換える
+        self.writer = pq.ParquetWriter(self.path + ".tmp", EXPORT_SCHEMA, compression="zstd",
+                                       use_dictionary=DICTIONARY_COLUMNS)
+
+    def write(self, rows: list) -> None:
+        columns = list(zip(*rows))[1:] if rows else [[] for _ in EXPORT_FIELDS]
+        self.writer.write_table(pa.Table.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, EXPORT_SCHEMA)],
+            schema=EXPORT_SCHEMA,
+        ))
+
+    def write_frame(self, frame) -> None:
+        frame = frame[list(EXPORT_FIELDS)]
+        frame.columns = EXPORT_SCHEMA.names
+        self.writer.write_table(pa.Table.from_pandas(frame, schema=EXPORT_SCHEMA, preserve_index=False))
+
+    def close(self) -> None:
+        self.writer.close()
+        os.replace(self.path + ".tmp", self.path)
+
+    def abort(self) -> None:
+        self.writer.close()
+        os.remove(self.path + ".tmp")
+
+
+def export_survey(directory: str, survey_number: int, batch_size: int = 100000) -> int:
+    """
+    DBのanswers_factから調査1つ分を書き出す
+    """
+    statement = select(*ANSWER_COLUMNS).where(Answer.survey_number == survey_number)
+    exporter = ParquetExporter(directory, survey_number)
+    count = 0
+    try:
+        with Engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(statement)
+            for rows in result.partitions():
+                exporter.write(rows)
+                count += len(rows)
+    except Exception:
+        exporter.abort()
+        raise
+    exporter.close()
+    return count
+
+
+def main(args):
+    """
+    メイン関数（export.py <出力先> [調査番号...]）
+    """
+    directory = args[1]
+    with Engine.connect() as connection:
+        survey_numbers = ([int(arg) for arg in args[2:]]
+                          or connection.execute(select(Survey.survey_number)).scalars().all())
+    for survey_number in survey_numbers:
+        print("survey_number: " + str(survey_number) + ", exported: " + str(export_survey(directory, survey_number)))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
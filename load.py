@@ -1,6 +1,32 @@
-import csv
-from migrate import Answer
-from setting import session
+import argparse
+import sys
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+import numpy as np
+import pandas as pd
+from sqlalchemy import Boolean, Float, func, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from migrate import Answer, create_partition, partition_name, response_partition_name
+from setting import new_session, session as default_session
+from reader import (DEFAULT_BUFFER_SIZE, RecordReader, is_compressed, open_source, read_chunk, read_header,
+                    resolve_indices, source_encoding, source_path, split_records)
+from constraints import DeferredConstraints
+from dimensions import AgeClassLookup, DimensionKeys
+from export import ParquetExporter
+import checkpoint
+import manifest
+from quarantine import Quarantine
+from metrics import LoadMetrics, configure_logging, profiling, write_textfile
+from pipeline import run_pipeline
+import responses
+import rollup
+import staging
+from writer import ANSWER_FIELDS, SOURCE_COLUMNS, SOURCE_FIELDS, WRITERS, ResponseWriter, frame_rows
 import os
 from dotenv import load_dotenv
 
@@ -25,7 +51,9 @@ class Loader:
             "working_situation": "y21_q17",
             "working_status":"y21_q18",
             "employment_status": "y21_q19",
-            "leaving_count": "y21_q55"
+            "leaving_count": "y21_q55",
+            # ウェイトの列名は調査年の接頭辞にxwtを付けたものと想定（OPTIONAL_FIELDSなのでなければNULL）
+            "weight": "y21_xwt"
         },
         1523: {
             "age": "y22_q2",
@@ -45,69 +73,612 @@ class Loader:
             "working_situation": "y22_q17",
             "working_status": "y22_q18",
             "employment_status": "y22_q19",
-            "leaving_count": "y22_q53"
+            "leaving_count": "y22_q53",
+            "weight": "y22_xwt"
         },
     }
 
-    def __init__(self):
+    TRANSFORMS = ("rows", "pandas")
+
+    # CSVになくてもロードを止めず、NULLとしてロードする属性
+    OPTIONAL_FIELDS = ("weight",)
+
+    # 再試行までの待ち時間（1回目の秒数から倍々に増やし、上限で止める）
+    RETRY_BACKOFF_SECONDS = 1.0
+    RETRY_BACKOFF_MAX_SECONDS = 30.0
+
+    def __init__(self, method: str = "orm", session: Session = None, batch_size: int = 1000, verify: bool = True,
+                 transform: str = "rows", staging: bool = False, export_dir: str = None, profile_dir: str = None,
+                 trace_memory: bool = False, writer_threads: int = 0, queue_size: int = 4, parse_workers: int = 0,
+                 chunk_bytes: int = 32 << 20, validate_keys: bool = True, quarantine_dir: str = "quarantine",
+                 resume: bool = False, retries: int = 0, read_buffer: int = DEFAULT_BUFFER_SIZE,
+                 responses: bool = False, frame_size: int = 100000, stage_timing: bool = False):
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive: %d" % batch_size)
+        if transform not in self.TRANSFORMS:
+            raise ValueError("unknown transform: %s" % transform)
+        if parse_workers > 0 and transform != "rows":
+            raise ValueError("parse_workers requires the rows transform")
+        if responses and (transform != "rows" or staging):
+            raise ValueError("responses requires the rows transform without staging")
         load_dotenv()
         self.csvDir = os.getenv("CSV_DIR")
+        self.method = method
+        self.batch_size = batch_size
+        self.verify = verify
+        self.transform = transform
+        self.staging = staging
+        self.export_dir = export_dir
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        self.metrics = None
+        self.writer_threads = writer_threads
+        self.queue_size = queue_size
+        self.parse_workers = parse_workers
+        self.chunk_bytes = chunk_bytes
+        self.validate_keys = validate_keys
+        self.quarantine_dir = quarantine_dir
+        self.resume = resume
+        self.retries = retries
+        self.read_buffer = read_buffer
+        self.responses = responses
+        self.frame_size = frame_size
+        self.stage_timing = stage_timing
+        self.session = session if session is not None else default_session
+        self.age_classes = None
+        self.questions = []
+        if (resume or retries > 0) and not self.checkpoints():
+            raise ValueError("resume and retries require the rows transform without parse_workers, writer_threads, "
+                             "staging or export_dir")
+
+    def csv_path(self, survey_number: int) -> str:
+        # 圧縮したままの.csv.gz・.csv.zst・.zipも探す
+        return source_path(self.csvDir, survey_number)
+
+    def is_up_to_date(self, survey_number: int) -> bool:
+        # ファイルとマッピングが前回のロードから変わっていないか
+        fingerprint = manifest.Fingerprint(self.csv_path(survey_number))
+        version = manifest.mapping_version(self.KEY_DICT_BY_SURVEY[survey_number])
+        up_to_date = manifest.is_up_to_date(self.session, survey_number, fingerprint, version)
+        self.session.commit()
+        return up_to_date
+
+    def load_all(self, workers: int = 1, force: bool = False, defer_constraints: bool = False,
+                 maintenance_workers: int = 4, metrics_textfile: str = None) -> list:
+        if defer_constraints and self.staging:
+            raise ValueError("defer_constraints cannot be combined with staging")
+        started = time.perf_counter()
+
+        # 前回から変わっていない調査はスキップ
+        survey_numbers = [survey_number for survey_number in self.KEY_DICT_BY_SURVEY.keys()
+                          if force or not self.is_up_to_date(survey_number)]
+        skipped = len(self.KEY_DICT_BY_SURVEY) - len(survey_numbers)
+
+        # ロードの間は外部キー・一意制約・副次索引を外しておく
+        deferred = None
+        if defer_constraints and survey_numbers:
+            deferred = DeferredConstraints(self.session.get_bind(), maintenance_workers)
+            deferred.drop()
+        else:
+            # 前回のロードが外した制約を作り直す前に止まっていれば、先に作り直す
+            pending = DeferredConstraints(self.session.get_bind(), maintenance_workers)
+            if pending.pending():
+                pending.restore()
+                pending.print_timings()
+
+        load_started = time.perf_counter()
+        try:
+            if workers > 1:
+                # 調査ごとにワーカープロセスでロード（ワーカーごとにEngineと接続を持つ）
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                    summaries = list(executor.map(_load_in_worker, [self.options()] * len(survey_numbers),
+                                                  survey_numbers))
+            else:
+                summaries = [self.load_retrying(survey_number) for survey_number in survey_numbers]
+        finally:
+            if deferred is not None:
+                deferred.timings["load"] = time.perf_counter() - load_started
+                self.session.rollback()
+                deferred.restore()
+                deferred.print_timings()
+
+        # 全調査の集計を出力
+        elapsed = time.perf_counter() - started
+        count = sum(summary["count"] for summary in summaries)
+        print("surveys: " + str(len(summaries)) + ", skipped: " + str(skipped) + ", count: " + str(count)
+              + ", workers: " + str(workers) + ", seconds: " + str(round(elapsed, 2))
+              + ", load seconds: " + str(round(sum(summary["seconds"] for summary in summaries), 2))
+              + ", rows/s: " + str(round(count / elapsed) if elapsed > 0 else 0))
+
+        # 調査ごとの計測値をPrometheusのtextfileに書き出す
+        if metrics_textfile:
+            write_textfile(metrics_textfile, summaries)
+        return summaries
+
+    def compare(self, survey_number: int) -> None:
+        # 同じCSVを各書き込み経路でロードして件数/秒を比較
+        method = self.method
+        try:
+            for self.method in WRITERS.keys():
+                self.load(survey_number)
+        finally:
+            self.method = method
+
+    def source_columns(self, survey_number: int) -> tuple:
+        # SOURCE_FIELDSに対応するCSVの列名
+        sources = {"answer_key": "key", "user_ID": "pkey", **self.KEY_DICT_BY_SURVEY[survey_number]}
+        return tuple(sources[field] for field in SOURCE_FIELDS)
+
+    def optional_columns(self, survey_number: int) -> tuple:
+        # OPTIONAL_FIELDSに対応するCSVの列名
+        return tuple(self.KEY_DICT_BY_SURVEY[survey_number][field] for field in self.OPTIONAL_FIELDS)
+
+    def read_columns(self, survey_number: int) -> tuple:
+        # 読み込む列（全設問も保存するなら、マッピング対象の列の後ろに設問の列を続ける）
+        return self.source_columns(survey_number) + tuple(self.questions)
+
+    def map_row(self, survey_number: int, values: tuple) -> tuple:
+        # 回答モデルにマッピング（並びはANSWER_FIELDS、全設問も保存するなら最後に設問の値のリストを付ける）
+        mapped = _map_values(survey_number, values, self.age_classes)
+        if self.responses:
+            return (*mapped, responses.to_responses(values[_SOURCE_COUNT:]))
+        return mapped
+
+    def map_frame(self, survey_number: int, sources: tuple, frame: pd.DataFrame) -> pd.DataFrame:
+        # 回答モデルに列単位でマッピング（列の並びはANSWER_FIELDS）
+        mapped = {"survey_number": np.full(len(frame), survey_number, dtype=np.int32)}
+        for field, column, source in zip(SOURCE_FIELDS, SOURCE_COLUMNS, sources):
+            if source in frame.columns:
+                values = frame[source].to_numpy(dtype=np.float64)
+            else:
+                # CSVにない省略可能な列は全て欠損
+                values = np.full(len(frame), np.nan)
+            null = np.isnan(values)
+            if isinstance(column.type, Boolean):
+                mapped[field] = values == 1
+            elif isinstance(column.type, Float):
+                mapped[field] = pd.arrays.FloatingArray(np.where(null, 0.0, values), null)
+            else:
+                if field == "main_job_income":
+                    null = np.zeros(len(values), dtype=bool)
+                values = np.where(np.isnan(values), 0.0, values)
+                if (values != np.trunc(values)).any():
+                    raise ValueError("survey_number: %d, column %s has non-integer values" % (survey_number, source))
+                mapped[field] = pd.arrays.IntegerArray(values.astype(np.int64), null)
+        mapped["age_class"] = self.age_classes.lookup_array(mapped["age"])
+        return pd.DataFrame(mapped, columns=ANSWER_FIELDS)
 
-    def load_all(self) -> None:
-        for survey_number in self.KEY_DICT_BY_SURVEY.keys():
-            self.load(survey_number)
-
-    def load(self, survey_number: int) -> None:
-
-        # その調査のレコードを事前に削除
-        session.query(Answer).filter(Answer.survey_number == survey_number).delete(synchronize_session='fetch')
-
-        # キーの辞書を取得
-        key_dict = self.KEY_DICT_BY_SURVEY[survey_number]
-
-        # CSVを読み込み
-        data = []
-        csvPath = self.csvDir + str(survey_number) + ".csv"
-        with open(csvPath, 'r') as file:
-            reader = csv.DictReader(file)
-            i = 0
-            for row in reader:
-
-                # 回答モデルにマッピング
-                data.append({
-                    "survey_number": survey_number,
-                    "answer_key": row['key'],
-                    "user_ID": row['pkey'],
-                    "age": row[key_dict['age']],
-                    "gender": row[key_dict['gender']],
-                    "educational_attainment": row[key_dict['educational_attainment']],
-                    "main_job_income": row[key_dict["main_job_income"]] if row[key_dict['main_job_income']] != '' else 0,
-                    "industry": row[key_dict['industry']] if row[key_dict['industry']] != '' else None,
-                    "company_size": row[key_dict['company_size']] if row[key_dict['company_size']] != '' else None,
-                    "occupation": row[key_dict['occupation']] if row[key_dict['occupation']] != '' else None,
-                    "degree": row[key_dict['degree']] if row[key_dict['degree']] != '' else None,
-                    "self_learning": row[key_dict['self_learning']] == '1',
-                    "place_of_residence": row[key_dict['place_of_residence']],
-                    "has_spouse": row[key_dict['has_spouse']] == '1',
-                    "has_children": row[key_dict['has_children']] == '1',
-                    "children_count": row[key_dict['children_count']] if row[key_dict['children_count']] != '' else None,
-                    "major": row[key_dict['major']] if row[key_dict['major']] != '' else None,
-                    "working_situation": row[key_dict['working_situation']] if row[key_dict['working_situation']] != '' else None,
-                    "working_status": row[key_dict['working_status']] if row[key_dict['working_status']] != '' else None,
-                    "employment_status": row[key_dict['employment_status']] if row[key_dict['employment_status']] != '' else None,
-                    "leaving_count": row[key_dict['leaving_count']] if row[key_dict['leaving_count']] != '' else None,
-                })
-
-                # 1000件ごとにバルクインサート
-                if i % 1000 == 0:
-                    session.bulk_insert_mappings(Answer, data)
+    def read_frames(self, survey_number: int):
+        # 必要な列だけを数値（欠損はNaN）としてチャンクごとに読み込み
+        csvPath = self.csv_path(survey_number)
+        sources = self.source_columns(survey_number)
+        with self.stage("open"):
+            encoding = source_encoding(csvPath, self.read_buffer)
+            header = read_header(csvPath, self.read_buffer, encoding)
+            resolve_indices(header, sources, csvPath, self.optional_columns(survey_number))
+        columns = sorted(set(sources) & set(header))
+        # read_csvと列ごとの変換はチャンクごとの処理が重いので、frame_size行（batch_sizeが大きければその行数）を
+        # 1つのバッチとして読み込み・書き込む
+        # 欠損を含む整数の列も、Int64で読むより浮動小数点数で読んでから変換するほうが速い
+        options = {"usecols": columns, "encoding": encoding, "chunksize": max(self.frame_size, self.batch_size),
+                   "dtype": np.float64}
+        if not is_compressed(csvPath):
+            with pd.read_csv(csvPath, memory_map=True, **options) as reader:
+                yield from reader
+        else:
+            with open_source(csvPath, self.read_buffer) as stream, pd.read_csv(stream, **options) as reader:
+                yield from reader
+
+    def map_frames(self, survey_number: int, frames):
+        sources = self.source_columns(survey_number)
+        for frame in frames:
+            yield self.map_frame(survey_number, sources, frame)
+
+    def read_rows(self, survey_number: int, start: int = None) -> RecordReader:
+        # CSVを1行ずつ読み込み、マッピング対象の列だけをタプルで返す（startのバイト位置から再開できる）
+        return RecordReader(self.csv_path(survey_number), self.read_columns(survey_number), start,
+                            buffer_size=self.read_buffer, stage=self.stage,
+                            optional=self.optional_columns(survey_number))
+
+    def checkpoints(self) -> bool:
+        # バッチごとにファイルの位置を記録できるのは、1行ずつ読み込んで呼び出し元のスレッドで順に書き込む場合だけ
+        return (self.transform == "rows" and self.parse_workers == 0 and self.writer_threads == 0
+                and not self.staging and not self.export_dir)
+
+    def read_chunks(self, survey_number: int):
+        # CSVをレコードの境界でチャンクに分け、ワーカープロセスで読み込み・マッピングしてファイルの順に返す
+        csvPath = self.csv_path(survey_number)
+        if is_compressed(csvPath):
+            raise ValueError("%s: parse_workers requires an uncompressed CSV" % csvPath)
+        with self.stage("open"):
+            encoding = source_encoding(csvPath, self.read_buffer)
+            indices = resolve_indices(read_header(csvPath, self.read_buffer, encoding),
+                                      self.read_columns(survey_number), csvPath, self.optional_columns(survey_number))
+            executor = ProcessPoolExecutor(max_workers=self.parse_workers)
+        try:
+            chunks = split_records(csvPath, self.chunk_bytes, executor)
+            # 先読みするチャンクはワーカー数の2倍まで（書き込みが遅くても結果が溜まり続けない）
+            pending = deque()
+            for start, end in chunks:
+                pending.append(executor.submit(_map_chunk, csvPath, start, end, indices, encoding, survey_number,
+                                               self.age_classes, self.responses))
+                if len(pending) >= self.parse_workers * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def stage(self, name: str):
+        # ロード中なら段階の時間を計測
+        return self.metrics.stage(name) if self.metrics is not None else nullcontext()
+
+    def timed_rows(self, rows, stage: str):
+        # 1行ごとの計測は1行あたり数百ナノ秒かかるので、stage_timingのときだけ行う（既定ではbatchにまとめて計測）
+        return self.metrics.timed(rows, stage) if self.stage_timing else rows
+
+    def map_rows(self, survey_number: int, rows):
+        for values in rows:
+            yield self.map_row(survey_number, values)
+
+    def load_retrying(self, survey_number: int) -> dict:
+        # DBとの接続が切れたなどの一時的な失敗では、最後にコミットしたバッチの続きから再開する
+        attempt = 0
+        while True:
+            try:
+                return self.load(survey_number, resume=self.resume or attempt > 0)
+            except OperationalError as error:
+                self.session.rollback()
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                backoff = min(self.RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1), self.RETRY_BACKOFF_MAX_SECONDS)
+                print("survey_number: " + str(survey_number) + ", retry: " + str(attempt) + ", backoff seconds: "
+                      + str(backoff) + ", error: " + str(error.orig).strip())
+                # DBが復旧するまで間を空ける
+                time.sleep(backoff)
+
+    def load(self, survey_number: int, resume: bool = None) -> dict:
+        session = self.session
+        resume = self.resume if resume is None else resume
+
+        # 年齢階級の区間表をage_classes_dimから作成
+        self.age_classes = AgeClassLookup.load(session)
+        # 外部キーの参照先のキーを読み込み、参照先にない値を含む行は書き込まずに隔離する
+        keys = DimensionKeys.load(session) if self.validate_keys else None
+        header = read_header(self.csv_path(survey_number), self.read_buffer)
+        # 全設問も保存するならヘッダーからキー以外の列を設問として並べる
+        self.questions = responses.question_columns(header) if self.responses else []
+        absent = [column for column in self.optional_columns(survey_number) if column not in header]
+        if absent:
+            warnings.warn("%s: optional columns missing from header, loaded as NULL: %s"
+                          % (self.csv_path(survey_number), ", ".join(absent)))
+
+        create_partition(session, survey_number)
+        session.commit()
+        started = time.perf_counter()
+        fingerprint = manifest.Fingerprint(self.csv_path(survey_number))
+        version = manifest.mapping_version(self.KEY_DICT_BY_SURVEY[survey_number])
+        checkpoints = self.checkpoints()
+        # 前回のロード途中の位置（ファイルの内容かマッピングが変わっていればNoneで、最初からロードし直す）
+        resumed = checkpoint.find(session, survey_number, fingerprint, version) if resume else None
+        if self.staging:
+            # ステージングテーブルへ書き込み、最後にパーティションと入れ替える
+            table_name = staging.create_staging(session, survey_number)
+        elif resumed is not None:
+            # 前回コミットしたバッチまでの行は残して続きから書き込む
+            table_name = None
+            print("survey_number: " + str(survey_number) + ", resumed at row: " + str(resumed.row_count)
+                  + ", answer_key: " + str(resumed.last_answer_key) + ", byte offset: " + str(resumed.byte_offset))
+        else:
+            # その調査のパーティションを事前に空にする（他の調査の件数に依存しない）
+            table_name = None
+            session.execute(text("TRUNCATE TABLE " + partition_name(survey_number)))
+            manifest.clear(session, survey_number)
+            checkpoint.clear(session, survey_number)
+            self.replace_responses(session, survey_number)
+
+        # 書き込み経路を選択
+        write = self.batch_writer(session, table_name)
+        if checkpoints:
+            # 位置の記録に使う内容のハッシュを先に計算しておく
+            fingerprint.content_hash
+
+        # 読み込み → マッピング → バッチ化 → 書き込み（メモリ上にはバッチ1つ分だけ保持）
+        metrics = self.metrics = LoadMetrics(survey_number, self.method, self.transform)
+        if self.transform == "pandas":
+            frames = metrics.timed(self.read_frames(survey_number), "parse")
+            batches = metrics.timed(self.map_frames(survey_number, frames), "map")
+        elif self.parse_workers > 0:
+            # 読み込みとマッピングはワーカープロセスで行うので、parseにマッピングの時間も含まれる
+            mapped = self.timed_rows(self.read_chunks(survey_number), "parse")
+            batches = metrics.timed(_batched(mapped, self.batch_size), "batch")
+        else:
+            records = self.read_rows(survey_number, resumed.byte_offset if resumed is not None else None)
+            rows = self.timed_rows(records, "parse")
+            mapped = self.timed_rows(self.map_rows(survey_number, rows), "map")
+            batches = metrics.timed(_batched(mapped, self.batch_size), "batch")
+        if keys is not None:
+            quarantine = Quarantine(self.quarantine_dir, survey_number, append=resumed is not None)
+            batches = self.validated(batches, keys, quarantine)
+        else:
+            quarantine = None
+        # ロードのついでにParquetにも書き出す
+        exporter = ParquetExporter(self.export_dir, survey_number) if self.export_dir else None
+
+        count = resumed.row_count if resumed is not None else 0
+        swap_seconds = None
+        with profiling(survey_number, self.profile_dir, self.trace_memory) as profile:
+            try:
+                if self.writer_threads > 0:
+                    # 読み込み・マッピングと書き込みを別スレッドで重ねる（空にしたパーティションを先にコミット）
                     session.commit()
-                    data = []
-                i += 1
+                    count = run_pipeline(self.exported(batches, exporter), partial(self.open_writer, table_name),
+                                         self.writer_threads, self.queue_size, metrics.observe_batch)
+                else:
+                    for batch in self.exported(batches, exporter):
+                        write_started = time.perf_counter()
+                        write(batch)
+                        if checkpoints:
+                            # バッチと同じトランザクションで、読み込んだ位置と最後のanswer_keyを記録
+                            checkpoint.save(session, survey_number, fingerprint, version, records.offset,
+                                            batch[-1][_ANSWER_KEY], count + len(batch))
+                        commit_started = time.perf_counter()
+                        session.commit()
+                        metrics.observe_batch(len(batch), commit_started - write_started,
+                                              time.perf_counter() - commit_started)
+                        count += len(batch)
+
+                # 件数を検証してから入れ替え（読み手がロックで待つのは入れ替えの間だけ）
+                if self.staging:
+                    with metrics.stage("prepare_staging"):
+                        staging.prepare_staging(session, survey_number, count)
+                    # 全設問の値も入れ替えと同じトランザクションで消す
+                    self.replace_responses(session, survey_number)
+                    swap_seconds = staging.swap(session, survey_number)
+                    metrics.add("swap", swap_seconds)
+            except Exception:
+                if self.staging:
+                    staging.drop_staging(session, survey_number)
+                if exporter is not None:
+                    exporter.abort()
+                raise
+            finally:
+                self.metrics = None
+                if quarantine is not None:
+                    quarantine.close()
+            if exporter is not None:
+                exporter.close()
+
+            # CSVの件数とDBの件数を照合
+            if self.verify:
+                with metrics.stage("verify"):
+                    self.verify_count(survey_number, count)
+
+            # ロード履歴を記録し、その調査の集計テーブルを更新
+            with metrics.stage("rollup"):
+                manifest.record(session, survey_number, fingerprint, version, count)
+                checkpoint.clear(session, survey_number)
+                rollup.refresh(session, survey_number)
+                session.commit()
+
+        # 調査番号とロード件数、書き込み経路ごとの件数/秒を出力
+        elapsed = time.perf_counter() - started
+        rejected = quarantine.count if quarantine is not None else 0
+        print("survey_number: " + str(survey_number) + ", count: " + str(count) + ", method: " + self.method
+              + ", rows/s: " + str(round(count / elapsed) if elapsed > 0 else 0)
+              + (", lock seconds: " + str(round(swap_seconds, 4)) if swap_seconds is not None else "")
+              + (", rejected: " + str(rejected) + " (" + quarantine.path + ")" if rejected else ""))
+        stages = metrics.stages()
+        metrics.log(seconds=elapsed, rejected=rejected, **profile)
+        return {"survey_number": survey_number, "count": count, "rejected": rejected, "method": self.method,
+                "seconds": elapsed,
+                "write_seconds": stages.get("write", 0.0) + stages.get("commit", 0.0), "lock_seconds": swap_seconds,
+                "metrics": metrics.to_dict(), **profile}
+
+    def replace_responses(self, session: Session, survey_number: int) -> None:
+        # 回答を入れ替えるときは、--responsesを指定していなくても古い全設問の値と設問の索引を消す
+        session.execute(text("TRUNCATE TABLE " + response_partition_name(survey_number)))
+        responses.replace_questions(session, survey_number, self.questions)
+
+    def validated(self, batches, keys: DimensionKeys, quarantine: Quarantine):
+        # 参照先にないキーを含む行を理由とともに隔離し、残りの行だけを書き込みへ流す
+        for batch in batches:
+            with self.stage("validate"):
+                if self.transform == "pandas":
+                    rejected, reasons = keys.check_frame(batch)
+                    if reasons:
+                        quarantine.write(frame_rows(batch[rejected]), [reasons[index] for index in sorted(reasons)])
+                        batch = batch[~rejected].reset_index(drop=True)
+                else:
+                    rejected, reasons = keys.check_rows(batch)
+                    if reasons:
+                        quarantine.write([batch[index] for index in sorted(reasons)],
+                                         [reasons[index] for index in sorted(reasons)])
+                        batch = [row for row, invalid in zip(batch, rejected.tolist()) if not invalid]
+            if len(batch):
+                yield batch
+
+    def exported(self, batches, exporter):
+        # ロードのついでにParquetにも書き出す
+        for batch in batches:
+            if exporter is not None:
+                with self.stage("export"):
+                    if self.transform == "pandas":
+                        exporter.write_frame(batch)
+                    else:
+                        exporter.write(batch)
+            yield batch
+
+    def batch_writer(self, session, table_name: str):
+        # バッチを書き込む関数（全設問も保存するなら、同じトランザクションでanswer_responsesにも書き込む）
+        writer = WRITERS[self.method](session, table_name)
+        write = writer.write_frame if self.transform == "pandas" else writer.write
+        if not self.responses:
+            return write
+        response_writer = ResponseWriter(session)
+
+        def write_with_responses(batch):
+            write(batch)
+            response_writer.write(batch)
+        return write_with_responses
+
+    def open_writer(self, table_name: str) -> tuple:
+        # 書き込みスレッドごとのセッションと書き込み経路
+        session = new_session(self.session.get_bind())
+        return session, self.batch_writer(session, table_name)
+
+    def verify_count(self, survey_number: int, expected: int) -> None:
+        actual = self.session.query(func.count(Answer.answer_id)).filter(Answer.survey_number == survey_number).scalar()
+        if actual != expected:
+            raise RuntimeError("survey_number: %d, CSV rows: %d, loaded rows: %d" % (survey_number, expected, actual))
+
+    def options(self) -> dict:
+        # ワーカープロセスへ渡す設定（セッションは除く）
+        return {"method": self.method, "batch_size": self.batch_size, "verify": self.verify,
+                "transform": self.transform, "staging": self.staging, "export_dir": self.export_dir,
+                "profile_dir": self.profile_dir, "trace_memory": self.trace_memory,
+                "writer_threads": self.writer_threads, "queue_size": self.queue_size,
+                "parse_workers": self.parse_workers, "chunk_bytes": self.chunk_bytes,
+                "validate_keys": self.validate_keys, "quarantine_dir": self.quarantine_dir,
+                "resume": self.resume, "retries": self.retries,
+                "read_buffer": self.read_buffer, "responses": self.responses, "frame_size": self.frame_size,
+                "stage_timing": self.stage_timing}
+
+
+def _batched(rows, batch_size: int):
+    # 指定件数ごとにまとめる（最後の端数も必ず返す）
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _to_int(value: str):
+    return int(value) if value != '' else None
+
+
+def _to_bool(value: str) -> bool:
+    return value == '1'
+
+
+def _to_income(value: str) -> int:
+    return int(value) if value != '' else 0
+
+
+def _to_float(value: str):
+    return float(value) if value != '' else None
+
+
+# SOURCE_FIELDSごとの変換
+_CONVERTERS = tuple(
+    _to_bool if isinstance(column.type, Boolean) else _to_float if isinstance(column.type, Float)
+    else _to_income if field == "main_job_income" else _to_int
+    for field, column in zip(SOURCE_FIELDS, SOURCE_COLUMNS)
+)
+_AGE = SOURCE_FIELDS.index("age")
+_ANSWER_KEY = ANSWER_FIELDS.index("answer_key")
+_SOURCE_COUNT = len(SOURCE_FIELDS)
+
+
+def _map_values(survey_number: int, values: tuple, age_classes: AgeClassLookup) -> tuple:
+    # 回答モデルにマッピング（並びはANSWER_FIELDS）
+    mapped = [convert(value) for convert, value in zip(_CONVERTERS, values)]
+    return (survey_number, *mapped, age_classes.lookup(mapped[_AGE]))
+
+
+def _map_chunk(path: str, start: int, end: int, indices: list, encoding: str, survey_number: int,
+               age_classes: AgeClassLookup, with_responses: bool = False) -> list:
+    # ワーカープロセスでチャンク1つを読み込み・マッピング
+    rows = read_chunk(path, start, end, indices, encoding)
+    if with_responses:
+        return [(*_map_values(survey_number, values, age_classes), responses.to_responses(values[_SOURCE_COUNT:]))
+                for values in rows]
+    return [_map_values(survey_number, values, age_classes) for values in rows]
+
+
+# ワーカープロセスごとのセッション
+_worker_session = None
+
+
+def _init_worker() -> None:
+    global _worker_session
+    # fork元から引き継いだ接続は使わず、ワーカー専用のEngineを作成
+    _worker_session = new_session()
+
+
+def _load_in_worker(options: dict, survey_number: int) -> dict:
+    return Loader(session=_worker_session, **options).load_retrying(survey_number)
+
+
+def main(args):
+    """
+    メイン関数
+    """
+    parser = argparse.ArgumentParser(prog=args[0])
+    parser.add_argument("--method", choices=WRITERS.keys(), default="orm", help="書き込み経路")
+    parser.add_argument("--compare", type=int, metavar="SURVEY_NUMBER",
+                        help="指定した調査を全ての書き込み経路でロードして件数/秒を比較")
+    parser.add_argument("--force", action="store_true", help="前回から変わっていない調査もロードし直す")
+    parser.add_argument("--workers", type=int, default=1, help="調査を並列にロードするワーカープロセス数")
+    parser.add_argument("--batch-size", type=int, default=1000, help="1回の書き込みとコミットの件数")
+    parser.add_argument("--no-verify", action="store_true", help="ロード後のCSVとDBの件数照合を行わない")
+    parser.add_argument("--transform", choices=Loader.TRANSFORMS, default="rows",
+                        help="行ごとのマッピングかpandasによる列単位のマッピングか")
+    parser.add_argument("--staging", action="store_true",
+                        help="UNLOGGEDのステージングテーブルにロードし、完了後にパーティションと入れ替える")
+    parser.add_argument("--defer-constraints", action="store_true",
+                        help="ロード中は外部キー・一意制約・副次索引を外し、ロード後に作り直す")
+    parser.add_argument("--maintenance-workers", type=int, default=4, help="制約と索引を作り直す並列数")
+    parser.add_argument("--export-dir", help="ロードした回答をParquetのデータセットとしても書き出すディレクトリ")
+    parser.add_argument("--metrics-log", help="計測値のJSONログの出力先（省略時は標準エラー出力）")
+    parser.add_argument("--metrics-textfile", help="計測値をPrometheusのtextfile形式で書き出すファイル")
+    parser.add_argument("--profile-dir", help="調査ごとのcProfileの結果（<調査番号>.prof）の出力先")
+    parser.add_argument("--trace-memory", action="store_true", help="tracemallocでメモリ割り当てを計測する")
+    parser.add_argument("--writer-threads", type=int, default=0,
+                        help="書き込みスレッド数（1以上で読み込みと書き込みを重ねる、それぞれ別の接続を使う）")
+    parser.add_argument("--queue-size", type=int, default=4, help="書き込み待ちにできるバッチ数の上限")
+    parser.add_argument("--parse-workers", type=int, default=0,
+                        help="1つのCSVをチャンクに分けて読み込み・マッピングするワーカープロセス数（rowsのみ）")
+    parser.add_argument("--chunk-bytes", type=int, default=32 << 20, help="ワーカーに渡すチャンクのおよそのバイト数")
+    parser.add_argument("--no-validate-keys", action="store_true",
+                        help="書き込む前に外部キーの参照先にキーがあるかを検証しない")
+    parser.add_argument("--quarantine-dir", default="quarantine",
+                        help="参照先にないキーを含む行を理由とともに書き出すディレクトリ（<調査番号>.csv）")
+    parser.add_argument("--resume", action="store_true",
+                        help="前回のロードが途中で止まった調査は、最後にコミットしたバッチの続きから再開する")
+    parser.add_argument("--retries", type=int, default=0,
+                        help="DBとの接続の失敗などで止まったとき、続きから再開する回数")
+    parser.add_argument("--read-buffer", type=int, default=DEFAULT_BUFFER_SIZE,
+                        help="圧縮した調査ファイル（.csv.gz・.csv.zst・.zip）を読むバッファのバイト数")
+    parser.add_argument("--responses", action="store_true",
+                        help="キー以外の全設問の値もanswer_responsesに保存する（rowsのみ）")
+    parser.add_argument("--frame-size", type=int, default=100000,
+                        help="pandasで1つのバッチとして読み込み・書き込む行数（--batch-sizeが大きければその行数）")
+    parser.add_argument("--stage-timing", action="store_true",
+                        help="rowsで読み込み（parse）とマッピング（map）の時間を1行ごとに分けて計測する")
+    options = parser.parse_args(args[1:])
+    configure_logging(options.metrics_log)
 
-            # 調査番号とロード件数を出力
-            print("survey_number: " + str(survey_number) + ", count: " + str(i))
+    loader = Loader(method=options.method, batch_size=options.batch_size, verify=not options.no_verify,
+                    transform=options.transform, staging=options.staging, export_dir=options.export_dir,
+                    profile_dir=options.profile_dir, trace_memory=options.trace_memory,
+                    writer_threads=options.writer_threads, queue_size=options.queue_size,
+                    parse_workers=options.parse_workers, chunk_bytes=options.chunk_bytes,
+                    validate_keys=not options.no_validate_keys, quarantine_dir=options.quarantine_dir,
+                    resume=options.resume, retries=options.retries, read_buffer=options.read_buffer,
+                    responses=options.responses, frame_size=options.frame_size,
+                    stage_timing=options.stage_timing)
+    if options.compare is not None:
+        loader.compare(options.compare)
+    else:
+        loader.load_all(workers=options.workers, force=options.force, defer_constraints=options.defer_constraints,
+                        maintenance_workers=options.maintenance_workers, metrics_textfile=options.metrics_textfile)
 
 
-loader = Loader()
-loader.load_all()
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,78 @@
+import datetime
+import hashlib
+import json
+import os
+
+from migrate import LoadCheckpoint, LoadManifest
+from writer import ANSWER_FIELDS
+
+
+class Fingerprint:
+    """
+    調査ファイルのサイズ・更新時刻・内容のハッシュ
+    """
+
+    def __init__(self, path: str):
+        stat = os.stat(path)
+        self.path = path
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self._content_hash = None
+
+    @property
+    def content_hash(self) -> str:
+        # 内容のハッシュは必要になったときに一度だけ計算
+        if self._content_hash is None:
+            self._content_hash = content_hash(self.path)
+        return self._content_hash
+
+
+def content_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    # ファイル全体を読み込まずにチャンクごとにハッシュを計算
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def mapping_version(key_dict: dict) -> str:
+    # マッピングの辞書と回答モデルの列が変わればバージョンも変わる
+    source = json.dumps({"key_dict": key_dict, "fields": ANSWER_FIELDS}, sort_keys=True)
+    return hashlib.blake2b(source.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def is_up_to_date(session, survey_number: int, fingerprint: Fingerprint, version: str) -> bool:
+    # ロード途中の位置が残っていれば、パーティションは途中までしか入っていない
+    if session.get(LoadCheckpoint, survey_number) is not None:
+        return False
+    manifest = session.get(LoadManifest, survey_number)
+    if manifest is None or manifest.mapping_version != version or manifest.file_size != fingerprint.size:
+        return False
+
+    # サイズと更新時刻が同じならハッシュを計算せずに最新とみなす
+    if manifest.file_mtime_ns == fingerprint.mtime_ns:
+        return True
+    if manifest.content_hash != fingerprint.content_hash:
+        return False
+
+    # 内容が同じで更新時刻だけ変わった場合は記録を更新
+    manifest.file_mtime_ns = fingerprint.mtime_ns
+    return True
+
+
+def record(session, survey_number: int, fingerprint: Fingerprint, version: str, row_count: int) -> None:
+    session.merge(LoadManifest(
+        survey_number=survey_number,
+        file_size=fingerprint.size,
+        file_mtime_ns=fingerprint.mtime_ns,
+        content_hash=fingerprint.content_hash,
+        mapping_version=version,
+        row_count=row_count,
+        loaded_at=datetime.datetime.now(),
+    ))
+
+
+def clear(session, survey_number: int) -> None:
+    # パーティションを空にするのと同じトランザクションで消す（途中で止まったロードを最新とみなさない）
+    session.query(LoadManifest).filter(LoadManifest.survey_number == survey_number).delete()
@@ -0,0 +1,195 @@
+import bisect
+import cProfile
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from prometheus_client import CollectorRegistry, write_to_textfile
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+from pythonjsonlogger import jsonlogger
+
+logger = logging.getLogger("jpsed_loader.metrics")
+
+# 段階の入れ子の順（各段階の時間は内側の段階の時間を含むので、差し引いて段階ごとの時間にする）
+NESTED_STAGES = ("open", "parse", "map", "batch")
+
+# バッチごとの書き込み・コミットの秒数のヒストグラムの境界
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+
+    def to_dict(self) -> dict:
+        return {"buckets": list(self.counts), "sum": self.sum, "count": sum(self.counts)}
+
+
+class LoadMetrics:
+    """
+    調査1つのロードの段階ごとの時間とバッチごとの件数・レイテンシ
+    """
+
+    def __init__(self, survey_number: int, method: str, transform: str):
+        self.survey_number = survey_number
+        self.method = method
+        self.transform = transform
+        self.inclusive = {}
+        self.rows = 0
+        self.batches = 0
+        self.latencies = {"write": Histogram(), "commit": Histogram()}
+        # 書き込みスレッドからも記録される
+        self.lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self.inclusive[stage] = self.inclusive.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def timed(self, iterable, stage: str):
+        # 次の要素を取り出すのにかかった時間を段階の時間として積算（ロックを取るのは最後の1回だけ）
+        iterator = iter(iterable)
+        clock = time.perf_counter
+        seconds = 0.0
+        try:
+            while True:
+                started = clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    seconds += clock() - started
+                    return
+                seconds += clock() - started
+                yield item
+        finally:
+            self.add(stage, seconds)
+
+    def observe_batch(self, rows: int, write_seconds: float, commit_seconds: float) -> None:
+        self.add("write", write_seconds)
+        self.add("commit", commit_seconds)
+        with self.lock:
+            self.rows += rows
+            self.batches += 1
+            batch = self.batches
+            self.latencies["write"].observe(write_seconds)
+            self.latencies["commit"].observe(commit_seconds)
+        logger.info("batch", extra={
+            "event": "batch", "survey_number": self.survey_number, "batch": batch, "rows": rows,
+            "write_seconds": write_seconds, "commit_seconds": commit_seconds,
+        })
+
+    def stages(self) -> dict:
+        stages = dict(self.inclusive)
+        inner = 0.0
+        for stage in NESTED_STAGES:
+            if stage in self.inclusive:
+                stages[stage] = self.inclusive[stage] - inner
+                inner = self.inclusive[stage]
+        return stages
+
+    def to_dict(self) -> dict:
+        return {
+            "survey_number": self.survey_number,
+            "method": self.method,
+            "transform": self.transform,
+            "rows": self.rows,
+            "batches": self.batches,
+            "stages": self.stages(),
+            "latencies": {name: histogram.to_dict() for name, histogram in self.latencies.items()},
+        }
+
+    def log(self, **fields) -> None:
+        logger.info("survey", extra={"event": "survey", **self.to_dict(), **fields})
+
+
+@contextmanager
+def profiling(survey_number: int, profile_dir: str = None, trace_memory: bool = False):
+    """
+    ロード中だけcProfileとtracemallocを有効にする（結果は<profile_dir>/<調査番号>.profとログへ）
+    """
+    result = {}
+    profiler = None
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        yield result
+    finally:
+        if trace_memory:
+            result["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            result["top_allocations"] = [str(stat) for stat in
+                                         tracemalloc.take_snapshot().statistics("lineno")[:10]]
+            tracemalloc.stop()
+        if profiler is not None:
+            profiler.disable()
+            result["profile"] = os.path.join(profile_dir, "%d.prof" % survey_number)
+            profiler.dump_stats(result["profile"])
+
+
+def configure_logging(path: str = None) -> None:
+    # 計測値を1行1件のJSONで出力（pathを指定しなければ標準エラー出力）
+    handler = logging.FileHandler(path) if path else logging.StreamHandler()
+    handler.setFormatter(jsonlogger.JsonFormatter("%(asctime)s %(name)s %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class _SummaryCollector:
+    def __init__(self, summaries: list):
+        self.summaries = summaries
+
+    def collect(self):
+        labels = ["survey_number", "method", "transform"]
+        rows = CounterMetricFamily("jpsed_load_rows", "Rows loaded", labels=labels)
+        batches = CounterMetricFamily("jpsed_load_batches", "Batches written", labels=labels)
+        stages = CounterMetricFamily("jpsed_load_stage_seconds", "Seconds spent per load stage",
+                                     labels=labels + ["stage"])
+        seconds = GaugeMetricFamily("jpsed_load_seconds", "Wall time of the last load", labels=labels)
+        latencies = {
+            name: HistogramMetricFamily("jpsed_load_batch_%s_seconds" % name, "Per-batch %s latency" % name,
+                                        labels=labels)
+            for name in ("write", "commit")
+        }
+        for summary in self.summaries:
+            metrics = summary["metrics"]
+            values = [str(metrics["survey_number"]), metrics["method"], metrics["transform"]]
+            rows.add_metric(values, metrics["rows"])
+            batches.add_metric(values, metrics["batches"])
+            seconds.add_metric(values, summary["seconds"])
+            for stage, stage_seconds in metrics["stages"].items():
+                stages.add_metric(values + [stage], stage_seconds)
+            for name, histogram in metrics["latencies"].items():
+                cumulative = 0
+                buckets = []
+                for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                    cumulative += count
+                    buckets.append(("+Inf" if bound == float("inf") else str(bound), cumulative))
+                latencies[name].add_metric(values, buckets, histogram["sum"])
+        yield from (rows, batches, stages, seconds, *latencies.values())
+
+
+def write_textfile(path: str, summaries: list) -> None:
+    """
+    ロード結果をnode_exporterのtextfile collector向けのPrometheus形式で書き出す
+    """
+    registry = CollectorRegistry()
+    registry.register(_SummaryCollector(summaries))
+    write_to_textfile(path, registry)
@@ -0,0 +1,79 @@
+import queue
+import threading
+import time
+
+# 書き込みスレッドへの終了の合図
+_DONE = object()
+
+
+def run_pipeline(batches, open_writer, writers: int, queue_size: int, on_batch) -> int:
+    """
+    呼び出し元のスレッドで読み込み・マッピングしたバッチを上限付きのキューに積み、
+    それぞれ自分の接続を持つ書き込みスレッドで書き込む。どこかで例外が起きたら全体を止めて再送出する
+
+    open_writer: 書き込みスレッドごとに呼ばれ、(session, write)を返す
+    on_batch: コミットしたバッチごとに(件数, 書き込み秒数, コミット秒数)で呼ばれる
+    """
+    batch_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    lock = threading.Lock()
+    written = [0]
+
+    def drain():
+        session = None
+        try:
+            session, write = open_writer()
+            while True:
+                batch = batch_queue.get()
+                if batch is _DONE:
+                    return
+                if stop.is_set():
+                    # 停止後は読み込み側が詰まらないよう取り出すだけ
+                    continue
+                write_started = time.perf_counter()
+                write(batch)
+                commit_started = time.perf_counter()
+                session.commit()
+                on_batch(len(batch), commit_started - write_started, time.perf_counter() - commit_started)
+                with lock:
+                    written[0] += len(batch)
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+            # 残りのバッチは終了の合図まで読み捨てる
+            while batch_queue.get() is not _DONE:
+                pass
+        finally:
+            if session is not None:
+                session.rollback()
+                session.close()
+
+    threads = [threading.Thread(target=drain, name="answers-writer-%d" % index, daemon=True)
+               for index in range(writers)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for batch in batches:
+            # キューが空くまで待つ（書き込みが止まったら読み込みもやめる）
+            while not stop.is_set():
+                try:
+                    batch_queue.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if stop.is_set():
+                break
+    except BaseException as error:
+        errors.append(error)
+        stop.set()
+    finally:
+        for _ in threads:
+            batch_queue.put(_DONE)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return written[0]
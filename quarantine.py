@@ -0,0 +1,38 @@
+import csv
+import os
+
+from writer import ANSWER_FIELDS
+
+
+class Quarantine:
+    """
+    外部キーの参照先にない値を含む行を理由とともに<directory>/<調査番号>.csvへ書き出す
+    （ファイルは最初の不正な行で作成し、続きから再開するとき以外は前回のロードの分を消す）
+    """
+
+    def __init__(self, directory: str, survey_number: int, append: bool = False):
+        self.path = os.path.join(directory, "%d.csv" % survey_number)
+        self.file = None
+        self.writer = None
+        self.count = 0
+        if not append and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def write(self, rows, reasons) -> None:
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            exists = os.path.exists(self.path)
+            self.file = open(self.path, 'a', newline='')
+            self.writer = csv.writer(self.file)
+            if not exists:
+                self.writer.writerow([*ANSWER_FIELDS, "reasons"])
+        for row, reason in zip(rows, reasons):
+            # 全設問の値は書き出さない
+            self.writer.writerow([*("" if value is None else value for value in row[:len(ANSWER_FIELDS)]),
+                                  "; ".join(reason)])
+            self.count += 1
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,152 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from sqlalchemy import select
+
+from migrate import AgeClass, AnswerRollup, CompanySize, Industry, LoadManifest, Occupation, PlaceOfResidence, Survey
+from rollup import income_quantile
+from setting import Engine
+
+# 次元ごとのラベルの列
+DIMENSION_LABELS = {
+    "industry": Industry.name,
+    "occupation": Occupation.title,
+    "company_size": CompanySize.name,
+    "age_class": AgeClass.name,
+    "place_of_residence": PlaceOfResidence.name,
+}
+
+
+class IncomeDistribution(NamedTuple):
+    """
+    調査×次元のキーごとの主な仕事の年収の分布
+    """
+    survey_number: int
+    year: int
+    key: int
+    label: Optional[str]
+    count: int
+    mean: Optional[float]
+    median: Optional[float]
+    histogram: list
+
+
+class QueryCache:
+    """
+    クエリ結果のLRUキャッシュ（合計サイズで追い出し、調査のロード履歴が変われば無効）
+    """
+
+    def __init__(self, max_bytes: int = 64 << 20, version_ttl: float = 5.0):
+        self.max_bytes = max_bytes
+        self.version_ttl = version_ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.versions = {}
+        self.versions_checked = None
+        self.lock = threading.Lock()
+
+    def survey_versions(self) -> dict:
+        # ロード履歴は一定時間ごとにだけ確認する
+        now = time.monotonic()
+        if self.versions_checked is None or now - self.versions_checked >= self.version_ttl:
+            with Engine.connect() as connection:
+                rows = connection.execute(select(LoadManifest.survey_number, LoadManifest.content_hash,
+                                                 LoadManifest.loaded_at)).all()
+            self.versions = {row[0]: tuple(row[1:]) for row in rows}
+            self.versions_checked = now
+        return self.versions
+
+    def get_or_load(self, key: tuple, survey_numbers: tuple, load):
+        versions = self.survey_versions()
+        version = tuple(versions.get(survey_number) for survey_number in survey_numbers)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] == version:
+                    self.entries.move_to_end(key)
+                    return entry[1]
+                self._remove(key)
+
+        value = load()
+        size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return value
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (version, value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+        return value
+
+    def _remove(self, key: tuple) -> None:
+        self.size -= self.entries.pop(key)[2]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.versions_checked = None
+
+
+cache = QueryCache()
+
+
+def survey_years() -> dict:
+    """
+    調査番号と調査年の対応
+    """
+    def load():
+        with Engine.connect() as connection:
+            return dict(connection.execute(select(Survey.survey_number, Survey.year)).all())
+    return cache.get_or_load(("survey_years",), (), load)
+
+
+def income_distribution(dimension: str, survey_number: int) -> list:
+    """
+    調査1つについて、次元のキーごとの年収の分布を集計テーブルから返す（キー0は未回答）
+    """
+    if dimension not in DIMENSION_LABELS:
+        raise ValueError("unknown dimension: %s" % dimension)
+
+    def load():
+        label = DIMENSION_LABELS[dimension]
+        statement = (
+            select(AnswerRollup.dimension_key, label, AnswerRollup.answer_count, AnswerRollup.income_sum,
+                   AnswerRollup.income_histogram)
+            .outerjoin(label.class_, label.class_.key == AnswerRollup.dimension_key)
+            .where(AnswerRollup.survey_number == survey_number, AnswerRollup.dimension == dimension)
+            .order_by(AnswerRollup.dimension_key)
+        )
+        with Engine.connect() as connection:
+            rows = connection.execute(statement).all()
+        year = survey_years().get(survey_number)
+        return [
+            IncomeDistribution(survey_number, year, key, name, count, income_sum / count if count else None,
+                               income_quantile(histogram, 0.5), list(histogram))
+            for key, name, count, income_sum, histogram in rows
+        ]
+    return cache.get_or_load(("income_distribution", dimension, survey_number), (survey_number,), load)
+
+
+def income_by_industry(survey_number: int) -> list:
+    return income_distribution("industry", survey_number)
+
+
+def income_by_occupation(survey_number: int) -> list:
+    return income_distribution("occupation", survey_number)
+
+
+def income_by_company_size(survey_number: int) -> list:
+    return income_distribution("company_size", survey_number)
+
+
+def income_by_age_class(survey_number: int) -> list:
+    return income_distribution("age_class", survey_number)
+
+
+def income_by_place_of_residence(survey_number: int) -> list:
+    return income_distribution("place_of_residence", survey_number)
@@ -0,0 +1,286 @@
+import codecs
+import csv
+import gzip
+import io
+import mmap
+import os
+import zipfile
+from contextlib import ExitStack, contextmanager, nullcontext
+from operator import itemgetter
+
+try:
+    import zstandard
+except ImportError:
+    # .csv.zstを読むときだけ必要
+    zstandard = None
+
+# 調査ファイルとして探す拡張子（先にあるものを優先）
+SOURCE_SUFFIXES = (".csv", ".csv.gz", ".csv.zst", ".zip")
+
+# 圧縮ファイルを読むときのバッファのバイト数
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+# 文字コードの判定に使う先頭のバイト数
+ENCODING_PREFIX = 1 << 16
+
+
+class MissingColumnError(ValueError):
+    """
+    マッピング対象の列がCSVのヘッダーに存在しない
+    """
+
+
+class RaggedRecordError(ValueError):
+    """
+    CSVのレコードの列がマッピング対象の列の位置まで届かない
+    """
+
+
+# ヘッダーにない省略可能な列の位置（行の末尾に足した空欄を指す）
+ABSENT = -1
+
+
+def resolve_indices(header: list, columns: tuple, path: str = "", optional: tuple = ()) -> list:
+    """
+    ヘッダーから必要な列の位置を一度だけ解決（同名の列は後ろを優先、DictReaderと同じ）
+    optionalの列はヘッダーになければABSENTにする（空欄として読む）
+    """
+    positions = {name: index for index, name in enumerate(header)}
+    missing = [column for column in columns if column not in positions and column not in optional]
+    if missing:
+        raise MissingColumnError("%s: mapped columns missing from header: %s" % (path, ", ".join(missing)))
+    return [positions.get(column, ABSENT) for column in columns]
+
+
+def projector(indices: list):
+    # 行のリストからindicesの列をタプルで取り出す関数（ABSENTの列は空欄、列が足りない行はIndexError）
+    project = itemgetter(*indices) if len(indices) > 1 else (lambda row: (row[indices[0]],))
+    if ABSENT not in indices:
+        return project
+    width = max(indices) + 1
+
+    def padded(row):
+        # 足した空欄を足りない列の代わりに読まないようにする
+        if len(row) < width:
+            raise IndexError("list index out of range")
+        row.append("")
+        return project(row)
+    return padded
+
+
+def _ragged(path: str, where: str, row: list, indices: list) -> RaggedRecordError:
+    return RaggedRecordError("%s: record %s has %d fields, mapped columns need %d"
+                             % (path, where, len(row), max(indices) + 1))
+
+
+def source_path(directory: str, survey_number: int) -> str:
+    # <調査番号>.csv、.csv.gz、.csv.zst、.zipの順に探す（どれもなければ.csvのパス）
+    for suffix in SOURCE_SUFFIXES:
+        path = directory + str(survey_number) + suffix
+        if os.path.exists(path):
+            return path
+    return directory + str(survey_number) + SOURCE_SUFFIXES[0]
+
+
+def is_compressed(path: str) -> bool:
+    return not path.endswith(SOURCE_SUFFIXES[0])
+
+
+@contextmanager
+def open_source(path: str, buffer_size: int = DEFAULT_BUFFER_SIZE):
+    """
+    調査ファイルを展開済みのバイト列として読むストリームを開く（一時ファイルには展開しない）
+    無圧縮のファイルはmmapで読み、zipは最初のCSVのメンバーを読む
+    """
+    if path.endswith(".csv.gz"):
+        with gzip.open(path, 'rb') as stream:
+            yield io.BufferedReader(stream, buffer_size)
+    elif path.endswith(".csv.zst"):
+        if zstandard is None:
+            raise RuntimeError("%s: reading .csv.zst requires the zstandard package" % path)
+        with open(path, 'rb') as file, \
+                zstandard.ZstdDecompressor().stream_reader(file, read_size=buffer_size) as stream:
+            yield io.BufferedReader(stream, buffer_size)
+    elif path.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            members = [name for name in archive.namelist() if name.endswith(".csv")]
+            if not members:
+                raise FileNotFoundError("%s: no .csv member in archive" % path)
+            with archive.open(members[0]) as stream:
+                yield io.BufferedReader(stream, buffer_size)
+    else:
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                yield io.BytesIO()
+            else:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    yield data
+
+
+def detect_encoding(prefix: bytes) -> str:
+    # 先頭のバイト列がUTF-8として読めればUTF-8（BOM付きも含む）、読めなければShift_JIS（CP932）
+    if prefix.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        # 途中で切れた最後の文字は判定に含めない
+        codecs.getincrementaldecoder("utf-8")().decode(prefix, final=False)
+    except UnicodeDecodeError:
+        return "cp932"
+    return "utf-8"
+
+
+def source_encoding(path: str, buffer_size: int = DEFAULT_BUFFER_SIZE) -> str:
+    with open_source(path, buffer_size) as stream:
+        return detect_encoding(stream.read(ENCODING_PREFIX))
+
+
+def _lines(stream):
+    # mmapもファイルも同じように1行ずつ読む
+    return iter(stream.readline, b"")
+
+
+def _skip(stream, count: int) -> None:
+    # 先へ読み進める（圧縮ストリームはシークできないことがあるので読み捨てる）
+    try:
+        stream.seek(count, os.SEEK_CUR)
+    except (OSError, io.UnsupportedOperation):
+        while count > 0:
+            data = stream.read(min(count, DEFAULT_BUFFER_SIZE))
+            if not data:
+                return
+            count -= len(data)
+
+
+def read_header(path: str, buffer_size: int = DEFAULT_BUFFER_SIZE, encoding: str = None) -> list:
+    encoding = encoding or source_encoding(path, buffer_size)
+    with open_source(path, buffer_size) as stream:
+        # 1行ずつ逐次デコードし、ヘッダーのレコードの分だけ読む
+        decoder = codecs.getincrementaldecoder(encoding)()
+        return next(csv.reader(decoder.decode(line) for line in _lines(stream)), [])
+
+
+class RecordReader:
+    """
+    必要な列だけをcolumnsの並びのタプルで返すCSVリーダー。返したレコードの終わりのバイト位置をoffsetに持ち、
+    startを指定するとヘッダーを読んだ後にその位置から読み始める。stageには段階の名前から時間を計測する
+    コンテキストマネージャを返す関数を渡す（ファイルを開くまでをopenとして計測する）
+    optionalの列はヘッダーになければ空欄として返す
+    """
+
+    def __init__(self, path: str, columns: tuple, start: int = None, encoding: str = None,
+                 buffer_size: int = DEFAULT_BUFFER_SIZE, stage=None, optional: tuple = ()):
+        self.path = path
+        self.columns = columns
+        self.optional = optional
+        self.start = start
+        self.encoding = encoding
+        self.buffer_size = buffer_size
+        self.stage = stage or (lambda name: nullcontext())
+        self.offset = 0
+
+    def _lines(self, file, decoder):
+        # csv.readerはレコードの終わりまでしか行を読まないので、行を渡した分だけ位置を進める
+        for line in _lines(file):
+            self.offset += len(line)
+            yield decoder.decode(line)
+
+    def __iter__(self):
+        with ExitStack() as stack:
+            with self.stage("open"):
+                encoding = self.encoding or source_encoding(self.path, self.buffer_size)
+                decoder = codecs.getincrementaldecoder(encoding)()
+                file = stack.enter_context(open_source(self.path, self.buffer_size))
+            indices = resolve_indices(next(csv.reader(self._lines(file, decoder)), []), self.columns, self.path,
+                                      self.optional)
+            if self.start is not None:
+                # 位置は展開後のバイト数
+                _skip(file, self.start - self.offset)
+                self.offset = self.start
+            project = projector(indices)
+            start = self.offset
+            for row in csv.reader(self._lines(file, decoder)):
+                try:
+                    record = project(row)
+                except IndexError:
+                    # 空行はDictReaderと同じく読み飛ばす
+                    if row:
+                        raise _ragged(self.path, "at byte %d" % start, row, indices) from None
+                    start = self.offset
+                    continue
+                yield record
+                start = self.offset
+
+
+def count_quotes(path: str, start: int, end: int) -> int:
+    # 指定範囲のダブルクォートの数（""のエスケープも2つと数えるので偶奇で引用符の内外が分かる）
+    with open(path, 'rb') as file:
+        file.seek(start)
+        return file.read(end - start).count(b'"')
+
+
+def _next_record_start(data, position: int, quoted: bool) -> int:
+    # positionから最初の、引用符の外にある改行の次の位置
+    while True:
+        newline = data.find(b"\n", position)
+        if newline < 0:
+            return len(data)
+        quoted ^= data[position:newline].count(b'"') % 2 == 1
+        if not quoted:
+            return newline + 1
+        position = newline + 1
+
+
+def split_records(path: str, chunk_bytes: int, executor=None) -> list:
+    """
+    ヘッダーを除いたCSVを、レコードの境界（引用符内の改行は除く）でおよそchunk_bytesごとの
+    (開始位置, 終了位置)に分ける。引用符の数は区間ごとにexecutorで並列に数える
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        header_end = _next_record_start(data, 0, False)
+        targets = list(range(header_end, size, max(chunk_bytes, 1)))[1:]
+
+        # 各目安位置までの引用符の数の偶奇を求め、その先の最初のレコードの境界で区切る
+        segments = list(zip([header_end, *targets], targets))
+        if executor is not None:
+            counts = list(executor.map(count_quotes, [path] * len(segments), *zip(*segments))) if segments else []
+        else:
+            counts = [count_quotes(path, start, end) for start, end in segments]
+        boundaries = [header_end]
+        parity = 0
+        for target, count in zip(targets, counts):
+            parity = (parity + count) % 2
+            boundary = _next_record_start(data, target, parity == 1)
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+        if boundaries[-1] < size:
+            boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def read_chunk(path: str, start: int, end: int, indices: list, encoding: str = "utf-8") -> list:
+    """
+    レコードの境界で区切った範囲を読み込み、indicesの列だけをタプルで返す
+    """
+    with open(path, 'rb') as file:
+        file.seek(start)
+        text = file.read(end - start).decode(encoding)
+    project = projector(indices)
+    records = csv.reader(io.StringIO(text, newline=''))
+    try:
+        return [project(row) for row in records]
+    except IndexError:
+        pass
+    # 列が足りないレコードがあれば、その位置を探してエラーにする（空行は読み飛ばす）
+    rows = []
+    records = csv.reader(io.StringIO(text, newline=''))
+    for row in records:
+        try:
+            rows.append(project(row))
+        except IndexError:
+            if row:
+                raise _ragged(path, "ending at line %d of the chunk from byte %d" % (records.line_num, start),
+                              row, indices) from None
+    return rows
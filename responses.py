@@ -0,0 +1,86 @@
+from sqlalchemy import func, select
+
+from migrate import AnswerResponse, SurveyQuestion
+
+# smallintに収まる値の範囲
+_SMALLINT_MIN = -(1 << 15)
+_SMALLINT_MAX = (1 << 15) - 1
+
+# 設問として扱わない列（回答とユーザーのキー）
+KEY_COLUMNS = ("key", "pkey")
+
+
+def question_columns(header: list) -> list:
+    # キー以外の全ての列をヘッダーの並びで設問とする
+    return [name for name in header if name not in KEY_COLUMNS]
+
+
+def to_smallint(value: str):
+    # 空欄・数値でない値・smallintに収まらない値はNULL
+    try:
+        number = int(value)
+    except ValueError:
+        return None
+    return number if _SMALLINT_MIN <= number <= _SMALLINT_MAX else None
+
+
+def to_responses(values) -> list:
+    return [to_smallint(value) for value in values]
+
+
+def replace_questions(session, survey_number: int, columns: list) -> None:
+    # 調査の設問の索引を作り直す（配列の添字は1から）
+    session.query(SurveyQuestion).filter(SurveyQuestion.survey_number == survey_number).delete()
+    session.add_all([SurveyQuestion(survey_number=survey_number, position=position, column_name=name)
+                     for position, name in enumerate(columns, start=1)])
+
+
+def question_positions(session, survey_number: int) -> dict:
+    # 列名 → 配列の添字
+    return dict(session.execute(
+        select(SurveyQuestion.column_name, SurveyQuestion.position)
+        .where(SurveyQuestion.survey_number == survey_number)
+    ).all())
+
+
+def _position(session, survey_number: int, column_name: str) -> int:
+    position = session.execute(
+        select(SurveyQuestion.position)
+        .where(SurveyQuestion.survey_number == survey_number, SurveyQuestion.column_name == column_name)
+    ).scalar()
+    if position is None:
+        raise KeyError("survey_number: %d has no question column: %s" % (survey_number, column_name))
+    return position
+
+
+def response(session, survey_number: int, answer_key: int, column_name: str):
+    # 1件の回答の1つの設問の値
+    position = _position(session, survey_number, column_name)
+    return session.execute(
+        select(AnswerResponse.responses[position])
+        .where(AnswerResponse.survey_number == survey_number, AnswerResponse.answer_key == answer_key)
+    ).scalar()
+
+
+def responses_by_key(session, survey_number: int, column_names: list) -> dict:
+    """
+    調査の全回答について指定した設問の値を読み出す（answer_key → 値のタプル）
+    パーティションを1回走査し、配列から必要な要素だけを取り出す
+    """
+    positions = [_position(session, survey_number, name) for name in column_names]
+    rows = session.execute(
+        select(AnswerResponse.answer_key, *[AnswerResponse.responses[position] for position in positions])
+        .where(AnswerResponse.survey_number == survey_number)
+    )
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+def value_counts(session, survey_number: int, column_name: str) -> dict:
+    # 設問の値ごとの回答数（空欄はNone）
+    position = _position(session, survey_number, column_name)
+    value = AnswerResponse.responses[position]
+    return dict(session.execute(
+        select(value, func.count())
+        .where(AnswerResponse.survey_number == survey_number)
+        .group_by(value)
+    ).all())
@@ -0,0 +1,76 @@
+import sys
+from sqlalchemy import text
+
+from migrate import AnswerRollup, Survey
+from setting import session
+
+# 主な仕事の年収（万円）の階級の境界。i番目の階級は[INCOME_BOUNDS[i-1], INCOME_BOUNDS[i])で、
+# 0番目は最初の境界未満、最後は最後の境界以上
+INCOME_BOUNDS = (1, *range(50, 1550, 50), 2000, 3000, 5000)
+
+# 集計する次元とanswers_factの列
+DIMENSIONS = {
+    "industry": "industry",
+    "occupation": "occupation",
+    "company_size": "company_size",
+    "age_class": "age_class",
+    "place_of_residence": "place_of_residence",
+}
+
+
+def refresh(session, survey_number: int) -> None:
+    """
+    指定した調査の集計だけを作り直す
+    """
+    bounds = "ARRAY[%s]" % ", ".join(str(bound) for bound in INCOME_BOUNDS)
+    histogram = "ARRAY[%s]" % ", ".join("count(*) FILTER (WHERE bucket = %d)" % bucket
+                                        for bucket in range(len(INCOME_BOUNDS) + 1))
+    session.execute(text("DELETE FROM %s WHERE survey_number = :survey_number" % AnswerRollup.__tablename__),
+                    {"survey_number": survey_number})
+    for dimension, key in DIMENSIONS.items():
+        session.execute(text(
+            "INSERT INTO %s (survey_number, dimension, dimension_key, answer_count, income_sum, income_histogram) "
+            "SELECT :survey_number, :dimension, dimension_key, count(*), coalesce(sum(main_job_income), 0), %s "
+            "FROM (SELECT coalesce(%s, 0) AS dimension_key, main_job_income, "
+            "width_bucket(main_job_income, %s) AS bucket "
+            "FROM answers_fact WHERE survey_number = :survey_number) t "
+            "GROUP BY dimension_key" % (AnswerRollup.__tablename__, histogram, key, bounds)
+        ), {"survey_number": survey_number, "dimension": dimension})
+
+
+def income_quantile(histogram: list, q: float) -> float:
+    """
+    年収の階級ごとの件数から分位点を線形補間で求める（中央値はq=0.5）
+    """
+    total = sum(histogram)
+    if total == 0:
+        return None
+    target = q * total
+    cumulative = 0
+    for bucket, count in enumerate(histogram):
+        if count and cumulative + count >= target:
+            lower = INCOME_BOUNDS[bucket - 1] if bucket > 0 else 0
+            if bucket == len(INCOME_BOUNDS):
+                return float(lower)
+            return lower + (INCOME_BOUNDS[bucket] - lower) * (target - cumulative) / count
+        cumulative += count
+    return float(INCOME_BOUNDS[-1])
+
+
+def main(args):
+    """
+    メイン関数（引数で調査番号を指定しなければ全調査の集計を作り直す）
+    """
+    survey_numbers = [int(arg) for arg in args[1:]] or [survey.survey_number for survey in session.query(Survey)]
+    for survey_number in survey_numbers:
+        refresh(session, survey_number)
+        session.commit()
+        print("refreshed rollups: " + str(survey_number))
+
+    # ロード履歴は変わらないので、作り直す前の集計をキャッシュから消す（queryはこのモジュールを読み込むのでここで読み込む）
+    import query
+    query.cache.clear()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,116 @@
+import re
+import time
+from sqlalchemy import UniqueConstraint, text
+
+from migrate import Answer, partition_name
+from setting import maintenance_statement_timeout
+
+
+def staging_name(survey_number: int) -> str:
+    return partition_name(survey_number) + "_staging"
+
+
+def foreign_key_definitions(session, table_name: str) -> list:
+    # テーブルに定義されている外部キーのDDL（FOREIGN KEY ... REFERENCES ...）
+    return session.execute(text(
+        "SELECT pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = CAST(:table_name AS regclass) AND contype = 'f' ORDER BY conname"
+    ), {"table_name": table_name}).scalars().all()
+
+
+def index_definitions(session, table_name: str) -> list:
+    # テーブルの制約に紐づかない索引のDDL（CREATE INDEX ... ON ONLY ...）
+    return session.execute(text(
+        "SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i "
+        "WHERE i.indrelid = CAST(:table_name AS regclass) "
+        "AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = i.indexrelid) ORDER BY 1"
+    ), {"table_name": table_name}).scalars().all()
+
+
+def create_staging(session, survey_number: int) -> str:
+    """
+    調査のパーティションと同じ列を持つUNLOGGEDのステージングテーブルを作成
+    """
+    name = staging_name(survey_number)
+    session.execute(text("DROP TABLE IF EXISTS " + name))
+    session.execute(text("CREATE UNLOGGED TABLE %s (LIKE %s INCLUDING DEFAULTS)"
+                         % (name, partition_name(survey_number))))
+    session.commit()
+    return name
+
+
+def prepare_staging(session, survey_number: int, expected: int) -> None:
+    """
+    件数を検証し、パーティションとして付け替えられる状態に整える
+    """
+    name = staging_name(survey_number)
+    actual = session.execute(text("SELECT count(*) FROM " + name)).scalar()
+    if actual != expected:
+        raise RuntimeError("survey_number: %d, CSV rows: %d, staged rows: %d" % (survey_number, expected, actual))
+
+    # 付け替え時に検証や索引作成が走らないよう、制約と索引をここで作っておく
+    session.execute(text("SET LOCAL statement_timeout = %d" % maintenance_statement_timeout()))
+    primary_key = ", ".join(column.name for column in Answer.__table__.primary_key.columns)
+    session.execute(text("ALTER TABLE %s ADD PRIMARY KEY (%s)" % (name, primary_key)))
+    for constraint in Answer.__table__.constraints:
+        if isinstance(constraint, UniqueConstraint):
+            columns = ", ".join(column.name for column in constraint.columns)
+            session.execute(text("ALTER TABLE %s ADD UNIQUE (%s)" % (name, columns)))
+    for definition in foreign_key_definitions(session, Answer.__tablename__):
+        session.execute(text("ALTER TABLE %s ADD %s" % (name, definition)))
+    # 親の副次索引も作っておく（なければ付け替えのロック中に作られる）
+    for definition in index_definitions(session, Answer.__tablename__):
+        session.execute(text(re.sub(r"^(CREATE (?:UNIQUE )?INDEX) \S+ ON (?:ONLY )?\S+", r"\1 ON " + name,
+                                    definition)))
+    session.execute(text("ALTER TABLE %s ADD CONSTRAINT survey_number_check CHECK "
+                         "(survey_number IS NOT NULL AND survey_number = %d)" % (name, survey_number)))
+
+    # WALに書き出してから入れ替える
+    session.execute(text("ALTER TABLE %s SET LOGGED" % name))
+    session.commit()
+
+
+def swap(session, survey_number: int) -> float:
+    """
+    ステージングテーブルを1トランザクションでパーティションと入れ替え、ロックを保持した秒数を返す
+    """
+    partition = partition_name(survey_number)
+    name = staging_name(survey_number)
+    started = time.perf_counter()
+    session.execute(text("ALTER TABLE %s DETACH PARTITION %s" % (Answer.__tablename__, partition)))
+    session.execute(text("ALTER TABLE %s ATTACH PARTITION %s FOR VALUES IN (%d)"
+                         % (Answer.__tablename__, name, survey_number)))
+    session.execute(text("ALTER TABLE %s DROP CONSTRAINT survey_number_check" % name))
+    session.execute(text("DROP TABLE " + partition))
+    session.execute(text("ALTER TABLE %s RENAME TO %s" % (name, partition)))
+    rename_to_partition(session, survey_number)
+    session.commit()
+    return time.perf_counter() - started
+
+
+def rename_to_partition(session, survey_number: int) -> None:
+    # 索引と制約の名前のステージングテーブル名の部分をパーティション名にする（次のロードで名前がぶつからない）
+    partition = partition_name(survey_number)
+    name = staging_name(survey_number)
+    indexes = session.execute(text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE i.indrelid = CAST(:table_name AS regclass) ORDER BY 1"
+    ), {"table_name": partition}).scalars().all()
+    for index in indexes:
+        if index.startswith(name):
+            # 主キーと一意制約は索引の名前を変えると制約の名前も変わる
+            session.execute(text('ALTER INDEX "%s" RENAME TO "%s"' % (index, partition + index[len(name):])))
+    constraints = session.execute(text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table_name AS regclass) "
+        "AND contype NOT IN ('p', 'u') ORDER BY 1"
+    ), {"table_name": partition}).scalars().all()
+    for constraint in constraints:
+        if constraint.startswith(name):
+            session.execute(text('ALTER TABLE %s RENAME CONSTRAINT "%s" TO "%s"'
+                                 % (partition, constraint, partition + constraint[len(name):])))
+
+
+def drop_staging(session, survey_number: int) -> None:
+    session.rollback()
+    session.execute(text("DROP TABLE IF EXISTS " + staging_name(survey_number)))
+    session.commit()
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import sys
+import numpy as np
+
+from load import Loader
+from migrate import SEED_DIR
+from writer import SOURCE_COLUMNS, SOURCE_FIELDS
+
+# 次元以外の属性の値の範囲（両端を含む）
+VALUE_RANGES = {
+    "answer_key": None,
+    "user_ID": None,
+    "age": (15, 79),
+    "gender": (1, 2),
+    "self_learning": (1, 2),
+    "has_spouse": (1, 2),
+    "has_children": (1, 2),
+    "children_count": (0, 5),
+    "leaving_count": (0, 10),
+    "weight": None,
+}
+
+
+def dimension_keys(column) -> np.ndarray:
+    # 外部キーの参照先のマスタデータ（seeds/<テーブル名>.json）のキー
+    foreign_key = next(iter(column.foreign_keys))
+    with open(os.path.join(SEED_DIR, foreign_key.column.table.name + ".json"), 'r') as file:
+        return np.array([row[foreign_key.column.name] for row in json.load(file)])
+
+
+class SyntheticSurvey:
+    """
+    KEY_DICT_BY_SURVEYの列名を持つJPSEDと同じ形の横長のCSVを生成する
+    """
+
+    def __init__(self, survey_number: int, columns: int = 300, blank_rate: float = 0.05, seed: int = 0):
+        self.survey_number = survey_number
+        self.blank_rate = blank_rate
+        self.random = np.random.default_rng(seed)
+
+        # マッピング対象の列（degreeとmajorのように同じ列を指す場合は先の属性に合わせる）
+        key_dict = Loader.KEY_DICT_BY_SURVEY[survey_number]
+        sources = {"answer_key": "key", "user_ID": "pkey", **key_dict}
+        self.mapped = {}
+        for field, column in zip(SOURCE_FIELDS, SOURCE_COLUMNS):
+            self.mapped.setdefault(sources[field], (field, column))
+
+        # それ以外の設問の列（y21_q<番号>のように調査年の接頭辞をそろえる）
+        prefix = next(iter(key_dict.values())).split("_")[0]
+        self.filler = []
+        number = 1
+        while len(self.mapped) + len(self.filler) < columns:
+            name = "%s_q%d" % (prefix, number)
+            if name not in self.mapped:
+                self.filler.append(name)
+            number += 1
+        self.header = [*self.mapped.keys(), *self.filler]
+        self.keys = {name: dimension_keys(column) for name, (_, column) in self.mapped.items() if column.foreign_keys}
+
+    def values(self, name: str, start: int, size: int) -> np.ndarray:
+        if name in self.mapped:
+            field, column = self.mapped[name]
+            if field in ("answer_key", "user_ID"):
+                return np.arange(start + 1, start + size + 1) * (1 if field == "answer_key" else 7919)
+            if name in self.keys:
+                return self.random.choice(self.keys[name], size)
+            if field == "main_job_income":
+                return np.minimum(self.random.lognormal(5.9, 0.6, size), 9999).astype(np.int64)
+            if field == "weight":
+                return np.round(self.random.lognormal(0.0, 0.5, size), 4)
+            low, high = VALUE_RANGES[field]
+            return self.random.integers(low, high + 1, size)
+        return self.random.integers(1, 6, size)
+
+    def write(self, path: str, rows: int, chunk_size: int = 10000) -> None:
+        with open(path, 'w', newline='') as file:
+            file.write(",".join(self.header) + "\n")
+            for start in range(0, rows, chunk_size):
+                size = min(chunk_size, rows - start)
+                columns = []
+                for name in self.header:
+                    values = self.values(name, start, size).astype(str).astype(object)
+                    # key/pkey以外は一定の割合で空欄にする
+                    if name not in ("key", "pkey"):
+                        values[self.random.random(size) < self.blank_rate] = ""
+                    columns.append(values)
+                file.writelines(",".join(row) + "\n" for row in zip(*columns))
+
+
+def main(args):
+    """
+    メイン関数
+    """
+    parser = argparse.ArgumentParser(prog=args[0])
+    parser.add_argument("directory", help="CSVの出力先（<調査番号>.csvを書き出す）")
+    parser.add_argument("--rows", type=int, default=10000, help="調査ごとの行数")
+    parser.add_argument("--columns", type=int, default=300, help="列数")
+    parser.add_argument("--blank-rate", type=float, default=0.05, help="空欄にするセルの割合")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--surveys", type=int, nargs="*", default=list(Loader.KEY_DICT_BY_SURVEY.keys()))
+    options = parser.parse_args(args[1:])
+
+    os.makedirs(options.directory, exist_ok=True)
+    for survey_number in options.surveys:
+        path = os.path.join(options.directory, str(survey_number) + ".csv")
+        SyntheticSurvey(survey_number, options.columns, options.blank_rate, options.seed).write(path, options.rows)
+        print("generated: " + path + ", rows: " + str(options.rows))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# リポジトリ直下のモジュール（reader.py、load.pyなど）をimportできるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# setting.pyは最初のimportで接続先を決めるので、テスト用のDBはどのテストよりも先に設定する
+if os.getenv("TEST_DATABASE_URL"):
+    os.environ["DATABASE_URL"] = os.environ["TEST_DATABASE_URL"]
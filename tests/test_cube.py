@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from cube import Cube, income_quantiles
+from rollup import INCOME_BOUNDS, income_quantile
+
+KEYS = {"industry": [0, 1, 2, 3], "age_class": [0, 1, 2], "company_size": [0, 1, 2]}
+# Cube.emptyと同じく、キー0（未回答）の表示名はNone
+LABELS = {dimension: {0: None, **{key: "%s-%d" % (dimension, key) for key in keys if key}}
+          for dimension, keys in KEYS.items()}
+
+
+@pytest.fixture
+def answers():
+    random = np.random.default_rng(1)
+    size = 2000
+    columns = {dimension: random.integers(0, len(keys) + 1, size).astype(np.float64)
+               for dimension, keys in KEYS.items()}
+    # 次元テーブルにないキー（4や3）とNULLは未回答（0）に数える
+    columns["industry"][random.random(size) < 0.05] = np.nan
+    income = np.minimum(random.lognormal(5.9, 0.8, size), 6000).round()
+    income[random.random(size) < 0.05] = np.nan
+    return columns, income
+
+
+def build(columns, income, dimensions=("industry", "age_class", "company_size")):
+    cube = Cube(dimensions, KEYS, LABELS)
+    # 2回に分けて足し込んでも1回と同じ
+    half = len(income) // 2
+    cube.add({dimension: values[:half] for dimension, values in columns.items()}, income[:half])
+    cube.add({dimension: values[half:] for dimension, values in columns.items()}, income[half:])
+    return cube
+
+
+def codes(columns, dimension):
+    keys = KEYS[dimension]
+    values = np.nan_to_num(columns[dimension]).astype(int)
+    return np.where(np.isin(values, keys), values, 0)
+
+
+def test_crosstab_matches_brute_force(answers):
+    columns, income = answers
+    crosstab = build(columns, income).crosstab("age_class", "industry", histogram=True)
+    assert crosstab.counts.shape == (3, 4)
+    assert crosstab.labels[0] == [None, "age_class-1", "age_class-2"]
+    age_class, industry = codes(columns, "age_class"), codes(columns, "industry")
+    filled = np.nan_to_num(income)
+    for a, age_key in enumerate(KEYS["age_class"]):
+        for i, industry_key in enumerate(KEYS["industry"]):
+            rows = (age_class == age_key) & (industry == industry_key)
+            assert crosstab.counts[a, i] == rows.sum()
+            assert crosstab.income_sum[a, i] == pytest.approx(filled[rows].sum())
+            if rows.any():
+                assert crosstab.income_mean()[a, i] == pytest.approx(filled[rows].mean())
+                histogram = np.bincount(np.searchsorted(INCOME_BOUNDS, filled[rows], side="right"),
+                                        minlength=len(INCOME_BOUNDS) + 1)
+                np.testing.assert_array_equal(crosstab.histogram[a, i], histogram)
+
+
+def test_crosstab_with_filters(answers):
+    columns, income = answers
+    crosstab = build(columns, income).crosstab("company_size", industry=[1, 3], age_class=2)
+    rows = np.isin(codes(columns, "industry"), [1, 3]) & (codes(columns, "age_class") == 2)
+    expected = [(rows & (codes(columns, "company_size") == key)).sum() for key in KEYS["company_size"]]
+    assert crosstab.counts.tolist() == expected
+    assert crosstab.keys[0].tolist() == KEYS["company_size"]
+
+
+def test_crosstab_without_dimensions_counts_everything(answers):
+    columns, income = answers
+    assert build(columns, income).crosstab().counts == len(income)
+
+
+def test_unknown_dimension():
+    with pytest.raises(ValueError, match="unknown dimensions"):
+        Cube(("gender",), KEYS, LABELS)
+
+
+@pytest.mark.parametrize("q", [0.0, 0.1, 0.25, 0.5, 0.9, 1.0])
+def test_income_quantiles_match_rollup(answers, q):
+    columns, income = answers
+    histogram = build(columns, income).crosstab("industry", "age_class", histogram=True).histogram
+    result = income_quantiles(histogram, q)
+    for index in np.ndindex(result.shape):
+        expected = income_quantile(histogram[index].tolist(), q)
+        if expected is None:
+            assert np.isnan(result[index])
+        else:
+            assert result[index] == pytest.approx(expected)
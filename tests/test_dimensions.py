@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from dimensions import AgeClassLookup, DimensionKeys
+from writer import ANSWER_FIELDS
+
+# seeds/age_classes_dim.jsonと同じ区間（[lower, upper)）
+AGE_CLASSES = AgeClassLookup([(20, 30, 2), (0, 20, 1), (30, 40, 3), (70, 100, 7)])
+
+
+@pytest.mark.parametrize("age, expected", [
+    (0, 1), (19, 1), (20, 2), (29, 2), (30, 3), (39, 3),
+    # 区間の間と範囲外
+    (40, None), (69, None), (70, 7), (99, 7), (100, None), (-1, None),
+    (None, None),
+])
+def test_lookup(age, expected):
+    assert AGE_CLASSES.lookup(age) == expected
+
+
+def test_lookup_array_matches_lookup():
+    ages = [0, 19, 20, 39, 40, 69, 70, 99, 100, -1, None]
+    keys = AGE_CLASSES.lookup_array(pd.array(ages, dtype="Int64"))
+    assert [None if pd.isna(key) else key for key in keys] == [AGE_CLASSES.lookup(age) for age in ages]
+
+
+def test_lookup_array_without_classes():
+    keys = AgeClassLookup([]).lookup_array(pd.array([20, None], dtype="Int64"))
+    assert keys.isna().all()
+
+
+def answer_rows(values: dict, size: int) -> list:
+    # 指定した属性以外は0の行タプル（並びはANSWER_FIELDS）
+    return [tuple(values.get(field, [0] * size)[index] for field in ANSWER_FIELDS) for index in range(size)]
+
+
+KEYS = DimensionKeys({"industry": ("industries_dim", [1, 2, 3, 5]), "age_class": ("age_classes_dim", [1, 2])})
+
+
+def test_check_rows():
+    rows = answer_rows({"industry": [1, 4, None, 5, 9], "age_class": [1, 2, None, 3, 1]}, 5)
+    rejected, reasons = KEYS.check_rows(rows)
+    assert rejected.tolist() == [False, True, False, True, True]
+    assert reasons == {
+        1: ["industry=4 not in industries_dim"],
+        3: ["age_class=3 not in age_classes_dim"],
+        4: ["industry=9 not in industries_dim"],
+    }
+
+
+def test_check_frame_matches_check_rows():
+    values = {"industry": [1, 4, None, 5, -2], "age_class": [1, 2, None, 3, 1]}
+    frame = pd.DataFrame({field: pd.array(values.get(field, [0] * 5), dtype="Int64") for field in ANSWER_FIELDS})
+    rejected, reasons = KEYS.check_frame(frame)
+    expected_rejected, expected_reasons = KEYS.check_rows(answer_rows(values, 5))
+    assert np.array_equal(rejected, expected_rejected)
+    assert reasons == expected_reasons
+    assert rejected.tolist() == [False, True, False, True, True]
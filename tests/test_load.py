@@ -0,0 +1,52 @@
+import csv
+import os
+
+import pytest
+
+# 調査のパーティションを空にしてロードするので、テスト用のDBを指定したときだけ実行する
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if not TEST_DATABASE_URL:
+    pytest.skip("TEST_DATABASE_URL is not set", allow_module_level=True)
+
+for module in ("numpy", "pandas", "sqlalchemy", "psycopg2", "dotenv"):
+    pytest.importorskip(module)
+
+import migrate  # noqa: E402
+from load import Loader  # noqa: E402
+from migrate import Answer  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures") + os.sep
+SURVEY_NUMBER = 1523
+
+
+def fixture_keys(survey_number: int) -> list:
+    # ローダーを通さずに数えたフィクスチャの回答のキー（引用符内の改行やカンマを含むレコードもある）
+    with open(FIXTURES + str(survey_number) + ".csv", newline="", encoding="utf-8") as file:
+        return [int(record["key"]) for record in csv.DictReader(file)]
+
+
+@pytest.fixture(scope="module")
+def database():
+    migrate.main(["migrate.py"])
+    yield migrate.session
+    migrate.session.rollback()
+
+
+@pytest.mark.parametrize("options", [
+    {"method": "orm"},
+    {"method": "copy_text"},
+    {"method": "copy_binary"},
+    {"method": "copy_binary", "transform": "pandas"},
+    {"method": "copy_binary", "staging": True},
+])
+def test_load_matches_fixture(database, monkeypatch, tmp_path, options):
+    monkeypatch.setenv("CSV_DIR", FIXTURES)
+    loader = Loader(session=database, batch_size=2, quarantine_dir=str(tmp_path), **options)
+    summary = loader.load(SURVEY_NUMBER)
+
+    expected = fixture_keys(SURVEY_NUMBER)
+    loaded = database.query(Answer.answer_key).filter(Answer.survey_number == SURVEY_NUMBER).all()
+    database.rollback()
+    assert summary["rejected"] == 0
+    assert summary["count"] == len(expected)
+    assert sorted(key for key, in loaded) == sorted(expected)
@@ -0,0 +1,125 @@
+import csv
+import gzip
+
+import pytest
+
+from reader import (MissingColumnError, RaggedRecordError, RecordReader, detect_encoding, read_chunk, read_header,
+                    resolve_indices, split_records)
+
+HEADER = ["key", "pkey", "memo", "age"]
+RECORDS = [
+    ["1", "11", "plain", "34"],
+    ["2", "12", "comma, inside", "27"],
+    ["3", "13", "line\nbreak", ""],
+    ["4", "14", "\"quoted\"\nand\r\nmore", "58"],
+    ["5", "15", "", "71"],
+]
+
+
+def write_csv(path, records=RECORDS, encoding="utf-8"):
+    with open(path, "w", newline="", encoding=encoding) as file:
+        writer = csv.writer(file)
+        writer.writerow(HEADER)
+        writer.writerows(records)
+    return str(path)
+
+
+def projected(records, columns):
+    indices = [HEADER.index(column) for column in columns]
+    return [tuple(record[index] for index in indices) for record in records]
+
+
+@pytest.mark.parametrize("chunk_bytes", [1, 7, 16, 40, 1 << 20])
+def test_split_records_keeps_quoted_newlines_in_one_chunk(tmp_path, chunk_bytes):
+    path = write_csv(tmp_path / "1523.csv")
+    chunks = split_records(path, chunk_bytes)
+    indices = resolve_indices(read_header(path), ("key", "memo", "age"), path)
+
+    # チャンクは隙間なく続き、合わせると全レコードをファイルの順に読める
+    assert all(end == start for (_, end), (start, _) in zip(chunks, chunks[1:]))
+    rows = [row for start, end in chunks for row in read_chunk(path, start, end, indices)]
+    assert rows == projected(RECORDS, ("key", "memo", "age"))
+
+
+def test_split_records_empty_file(tmp_path):
+    path = tmp_path / "1523.csv"
+    path.write_bytes(b"")
+    assert split_records(str(path), 16) == []
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".csv.gz"])
+def test_record_reader_resumes_at_offset(tmp_path, suffix):
+    path = write_csv(tmp_path / "1523.csv")
+    if suffix == ".csv.gz":
+        with open(path, "rb") as source, gzip.open(path + ".gz", "wb") as target:
+            target.write(source.read())
+        path += ".gz"
+    columns = ("age", "key")
+
+    # 各レコードを読んだ直後の位置から再開すると、残りのレコードだけを読む
+    reader = RecordReader(path, columns)
+    offsets = []
+    rows = []
+    for row in reader:
+        rows.append(row)
+        offsets.append(reader.offset)
+    assert rows == projected(RECORDS, columns)
+    for done, offset in enumerate(offsets, start=1):
+        assert list(RecordReader(path, columns, start=offset)) == projected(RECORDS[done:], columns)
+
+
+def test_record_reader_reports_missing_columns(tmp_path):
+    path = write_csv(tmp_path / "1523.csv")
+    with pytest.raises(MissingColumnError, match="weight"):
+        list(RecordReader(path, ("key", "weight")))
+
+
+def test_record_reader_reads_absent_optional_columns_as_blank(tmp_path):
+    path = write_csv(tmp_path / "1523.csv")
+    rows = list(RecordReader(path, ("key", "weight"), optional=("weight",)))
+    assert rows == [(record[0], "") for record in RECORDS]
+
+
+def test_record_reader_decodes_cp932(tmp_path):
+    records = [["1", "11", "東京都", "34"], ["2", "12", "大阪府", "27"]]
+    path = write_csv(tmp_path / "1523.csv", records, encoding="cp932")
+    assert list(RecordReader(path, ("memo",))) == [("東京都",), ("大阪府",)]
+
+
+def write_lines(path, lines):
+    path.write_bytes("".join(line + "\n" for line in [",".join(HEADER), *lines]).encode("utf-8"))
+    return str(path)
+
+
+@pytest.mark.parametrize("columns, optional", [(("key", "age"), ()), (("key", "age", "weight"), ("weight",))])
+def test_record_reader_reports_short_records(tmp_path, columns, optional):
+    path = write_lines(tmp_path / "1523.csv", ["1,11,a,34", "", "2,12,b", "3,13,c,58"])
+    reader = RecordReader(path, columns, optional=optional)
+    rows = iter(reader)
+    assert next(rows)[0] == "1"
+    # 空行は読み飛ばし、列が足りないレコードはその先頭のバイト位置を示す
+    offset = len("key,pkey,memo,age\n1,11,a,34\n\n")
+    with pytest.raises(RaggedRecordError, match=r"1523\.csv: record at byte %d has 3 fields" % offset):
+        next(rows)
+
+
+def test_read_chunk_reports_short_records(tmp_path):
+    path = write_lines(tmp_path / "1523.csv", ["1,11,a,34", "", "2,12,\"b\nc\"", "3,13,c,58"])
+    indices = resolve_indices(HEADER, ("key", "age"), path)
+    start, end = split_records(path, 1 << 20)[0]
+    with pytest.raises(RaggedRecordError, match="ending at line 4 of the chunk from byte %d" % start):
+        read_chunk(path, start, end, indices)
+    assert read_chunk(path, start, start + len("1,11,a,34\n\n"), indices) == [("1", "34")]
+
+
+@pytest.mark.parametrize("prefix, expected", [
+    (b"key,pkey\n1,2\n", "utf-8"),
+    ("key,都道府県\n".encode("utf-8"), "utf-8"),
+    (b"\xef\xbb\xbf" + "key,都道府県\n".encode("utf-8"), "utf-8-sig"),
+    ("key,都道府県\n".encode("cp932"), "cp932"),
+    # 先頭だけを読んだので最後の文字が途中で切れていてもUTF-8
+    ("key,都道府県".encode("utf-8")[:-1], "utf-8"),
+    (b"", "utf-8"),
+])
+def test_detect_encoding(prefix, expected):
+    assert detect_encoding(prefix) == expected
@@ -0,0 +1,97 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from weighted import group, weighted_mean, weighted_quantiles, weighted_shares, weighted_total
+
+
+@pytest.fixture
+def sample():
+    random = np.random.default_rng(0)
+    size = 500
+    values = random.integers(0, 40, size).astype(np.float64)
+    weights = random.lognormal(0.0, 0.5, size)
+    values[random.random(size) < 0.1] = np.nan
+    weights[random.random(size) < 0.05] = 0.0
+    industry = random.integers(1, 4, size).astype(np.float64)
+    industry[random.random(size) < 0.05] = np.nan
+    gender = random.integers(1, 3, size).astype(np.float64)
+    return values, weights, group({"industry": industry, "gender": gender})
+
+
+def cells(groups):
+    # グループの添字ごとの行の位置（総当たりの参照実装用）
+    for cell in range(groups.size):
+        yield np.unravel_index(cell, groups.shape), np.flatnonzero(groups.codes == cell)
+
+
+def reference_quantile(values, weights, q):
+    # 累積ウェイトの割合がq以上になる最小の値を1つずつ調べる
+    valid = ~np.isnan(values) & ~np.isnan(weights) & (weights > 0)
+    pairs = sorted(zip(values[valid], weights[valid]))
+    if not pairs:
+        return np.nan
+    total = sum(weight for _, weight in pairs)
+    cumulative = 0.0
+    for value, weight in pairs:
+        cumulative += weight
+        if cumulative / total >= q - 1e-12:
+            return value
+    return pairs[-1][0]
+
+
+def test_group_puts_missing_last():
+    groups = group({"industry": [3, np.nan, 1, 3]})
+    assert groups.shape == (3,)
+    assert groups.keys[0][:2].tolist() == [1, 3] and np.isnan(groups.keys[0][2])
+    assert groups.codes.tolist() == [1, 2, 0, 1]
+
+
+def test_weighted_total(sample):
+    _, weights, groups = sample
+    totals = weighted_total(weights, groups)
+    for index, rows in cells(groups):
+        assert totals[index] == pytest.approx(weights[rows].sum())
+    assert weighted_total(weights) == pytest.approx(weights.sum())
+
+
+def test_weighted_mean(sample):
+    values, weights, groups = sample
+    means = weighted_mean(values, weights, groups)
+    for index, rows in cells(groups):
+        valid = rows[~np.isnan(values[rows])]
+        if weights[valid].sum() > 0:
+            assert means[index] == pytest.approx((values[valid] * weights[valid]).sum() / weights[valid].sum())
+        else:
+            assert np.isnan(means[index])
+
+
+@pytest.mark.parametrize("quantiles", [(0.0, 0.25, 0.5, 0.75, 1.0), (0.5,)])
+def test_weighted_quantiles(sample, quantiles):
+    values, weights, groups = sample
+    result = weighted_quantiles(values, weights, quantiles, groups)
+    assert result.shape == groups.shape + (len(quantiles),)
+    for index, rows in cells(groups):
+        expected = [reference_quantile(values[rows], weights[rows], q) for q in quantiles]
+        np.testing.assert_array_equal(result[index], expected)
+    overall = weighted_quantiles(values, weights, quantiles)
+    np.testing.assert_array_equal(overall, [reference_quantile(values, weights, q) for q in quantiles])
+
+
+def test_weighted_shares(sample):
+    values, weights, groups = sample
+    categories, shares = weighted_shares(values, weights, groups)
+    for index, rows in cells(groups):
+        total = weights[rows].sum()
+        for position, category in enumerate(categories):
+            matched = rows[np.isnan(values[rows])] if np.isnan(category) else rows[values[rows] == category]
+            assert shares[index + (position,)] == pytest.approx(weights[matched].sum() / total)
+
+
+def test_missing_weights_are_excluded_with_warning():
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        mean = weighted_mean([1.0, 2.0, 4.0], [1.0, np.nan, 3.0])
+    assert mean == pytest.approx((1.0 + 12.0) / 4.0)
+    assert "1 of 3 rows have no weight" in str(caught[0].message)
@@ -0,0 +1,98 @@
+import struct
+
+import numpy as np
+import pandas as pd
+
+from writer import (ANSWER_COLUMNS, ANSWER_FIELDS, CopyBinaryWriter, CopyTextWriter, ResponseWriter,
+                    frame_rows)
+
+# PostgreSQLのバイナリ形式のCOPYの先頭（署名、フラグ、ヘッダー拡張の長さ）と末尾
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + b"\x00\x00\x00\x00" + b"\x00\x00\x00\x00"
+PGCOPY_TRAILER = b"\xff\xff"
+
+
+def sample_row(**values) -> tuple:
+    # 型ごとに区別できる値の行タプル（並びはANSWER_FIELDS）
+    row = []
+    for index, (field, column) in enumerate(zip(ANSWER_FIELDS, ANSWER_COLUMNS)):
+        kind = type(column.type).__name__
+        default = True if kind == "Boolean" else 0.25 * index if kind == "Float" else 1000 + index
+        row.append(values.get(field, default))
+    return tuple(row)
+
+
+def expected_field(column, value) -> bytes:
+    # カラムの型ごとの長さ（4バイト）と値
+    if value is None:
+        return b"\xff\xff\xff\xff"
+    kind = type(column.type).__name__
+    if kind == "BigInteger":
+        return b"\x00\x00\x00\x08" + value.to_bytes(8, "big", signed=True)
+    if kind == "Boolean":
+        return b"\x00\x00\x00\x01" + (b"\x01" if value else b"\x00")
+    if kind == "Integer":
+        return b"\x00\x00\x00\x04" + value.to_bytes(4, "big", signed=True)
+    if kind == "Float":
+        return b"\x00\x00\x00\x08" + struct.pack(">d", value)
+    raise AssertionError(kind)
+
+
+def expected_tuple(row) -> bytes:
+    return len(ANSWER_COLUMNS).to_bytes(2, "big") + b"".join(
+        expected_field(column, value) for column, value in zip(ANSWER_COLUMNS, row))
+
+
+ROWS = [
+    sample_row(),
+    sample_row(age=None, industry=None, weight=None, age_class=None, has_spouse=False),
+    sample_row(answer_key=-7, main_job_income=0),
+]
+
+
+def test_binary_encode_layout():
+    data = b"".join(CopyBinaryWriter(None).encode(ROWS))
+    assert data == PGCOPY_HEADER + b"".join(expected_tuple(row) for row in ROWS) + PGCOPY_TRAILER
+
+
+def test_binary_encode_empty():
+    assert b"".join(CopyBinaryWriter(None).encode([])) == PGCOPY_HEADER + PGCOPY_TRAILER
+
+
+def rows_frame(rows) -> pd.DataFrame:
+    # map_frameと同じ型（整数はInt64、浮動小数点数はFloat64、真偽値はbool）のDataFrame
+    columns = {}
+    for index, (field, column) in enumerate(zip(ANSWER_FIELDS, ANSWER_COLUMNS)):
+        values = [row[index] for row in rows]
+        kind = type(column.type).__name__
+        columns[field] = (np.array(values, dtype=bool) if kind == "Boolean"
+                          else pd.array(values, dtype="Float64" if kind == "Float" else "Int64"))
+    return pd.DataFrame(columns, columns=ANSWER_FIELDS)
+
+
+def test_binary_encode_frame_matches_rows():
+    writer = CopyBinaryWriter(None)
+    assert writer.encode_frame(rows_frame(ROWS)) == b"".join(writer.encode(ROWS))
+    assert writer.encode_frame(rows_frame([])) == PGCOPY_HEADER + PGCOPY_TRAILER
+
+
+def test_frame_rows_round_trip():
+    assert frame_rows(rows_frame(ROWS)) == ROWS
+
+
+def test_text_encode():
+    line = b"".join(CopyTextWriter(None).encode(ROWS[1:2])).decode("utf-8")
+    values = line.rstrip("\n").split("\t")
+    assert len(values) == len(ANSWER_FIELDS)
+    assert values[ANSWER_FIELDS.index("age")] == "\\N"
+    assert values[ANSWER_FIELDS.index("has_spouse")] == "f"
+    assert values[ANSWER_FIELDS.index("has_children")] == "t"
+
+
+def test_response_encode_skips_rows_without_answer_key():
+    rows = [
+        (*sample_row(survey_number=1523, answer_key=4), [1, None, -3]),
+        (*sample_row(survey_number=1523, answer_key=None), [2]),
+        (*sample_row(survey_number=1523, answer_key=5), []),
+    ]
+    lines = b"".join(ResponseWriter(None).encode(rows)).decode("utf-8")
+    assert lines == "1523\t4\t{1,NULL,-3}\n1523\t5\t{}\n"
@@ -0,0 +1,177 @@
+import warnings
+from typing import NamedTuple
+import numpy as np
+from sqlalchemy import select
+
+from migrate import Answer
+from setting import Engine
+
+
+class Groups(NamedTuple):
+    """
+    1つ以上の列の値の組ごとのグループ（codesは行ごとのグループの添字）
+    """
+    columns: tuple
+    keys: list
+    shape: tuple
+    codes: np.ndarray
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape, dtype=np.int64))
+
+
+def group(columns: dict) -> Groups:
+    """
+    列ごとに値を添字に変換し、値の組をグループの添字にする（グループの配列の形はshape）
+    欠損（NaN）は各列の最後の添字にまとめる
+    """
+    keys = []
+    codes = []
+    for values in columns.values():
+        values = np.asarray(values, dtype=np.float64)
+        missing = np.isnan(values)
+        unique, code = np.unique(values[~missing], return_inverse=True)
+        full = np.full(len(values), len(unique), dtype=np.int64)
+        full[~missing] = code
+        keys.append(np.append(unique, np.nan) if missing.any() else unique)
+        codes.append(full)
+    shape = tuple(len(unique) for unique in keys)
+    return Groups(tuple(columns), keys, shape, np.ravel_multi_index(codes, shape) if codes else np.zeros(0, np.int64))
+
+
+def _weights(weights) -> np.ndarray:
+    # ウェイトの配列（CSVにウェイトの列がなかった調査はNULLなので、その行は集計から除く）
+    weights = np.asarray(weights, dtype=np.float64)
+    missing = int(np.isnan(weights).sum())
+    if missing:
+        warnings.warn("%d of %d rows have no weight and are excluded" % (missing, len(weights)), stacklevel=3)
+    return weights
+
+
+def _valid(values: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    # 値とウェイトの両方があり、ウェイトが負でない行
+    return ~np.isnan(values) & ~np.isnan(weights) & (weights >= 0)
+
+
+def weighted_total(weights: np.ndarray, groups: Groups = None) -> np.ndarray:
+    # グループごとのウェイトの合計（推計した母集団の人数）
+    weights = np.nan_to_num(_weights(weights))
+    if groups is None:
+        return np.array(weights.sum())
+    return np.bincount(groups.codes, weights=weights, minlength=groups.size).reshape(groups.shape)
+
+
+def weighted_mean(values: np.ndarray, weights: np.ndarray, groups: Groups = None) -> np.ndarray:
+    """
+    ウェイト付きの平均（グループを指定すればグループごと、ウェイトの合計が0のグループはNaN）
+    """
+    values = np.asarray(values, dtype=np.float64)
+    weights = _weights(weights)
+    valid = _valid(values, weights)
+    products = np.where(valid, values * weights, 0.0)
+    weights = np.where(valid, weights, 0.0)
+    if groups is None:
+        numerator, denominator = products.sum(), weights.sum()
+    else:
+        numerator = np.bincount(groups.codes, weights=products, minlength=groups.size).reshape(groups.shape)
+        denominator = np.bincount(groups.codes, weights=weights, minlength=groups.size).reshape(groups.shape)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+def weighted_quantiles(values: np.ndarray, weights: np.ndarray, quantiles, groups: Groups = None) -> np.ndarray:
+    """
+    ウェイト付きの分位点（累積ウェイトの割合がq以上になる最小の値）
+    全グループを1回のソートで求める。戻り値の形はグループの形 + (分位点の数,)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    weights = _weights(weights)
+    quantiles = np.atleast_1d(np.asarray(quantiles, dtype=np.float64))
+    # ウェイトが0の行は分位点に影響しない
+    valid = _valid(values, weights) & (weights > 0)
+    codes = groups.codes[valid] if groups is not None else np.zeros(int(valid.sum()), dtype=np.int64)
+    size = groups.size if groups is not None else 1
+    values = values[valid]
+    weights = weights[valid]
+
+    # グループ、値の順に並べ、グループ内の累積ウェイトの割合を求める
+    order = np.lexsort((values, codes))
+    codes = codes[order]
+    values = values[order]
+    weights = weights[order]
+    totals = np.bincount(codes, weights=weights, minlength=size)
+    counts = np.bincount(codes, minlength=size)
+    # 前のグループまでのウェイトの合計を引いてグループ内の累積にする
+    cumulative = np.cumsum(weights) - (np.cumsum(totals) - totals)[codes]
+    share = cumulative / totals[codes]
+    # 丸め誤差で各グループの最後が1未満にならないようにする
+    share[np.cumsum(counts)[counts > 0] - 1] = 1.0
+
+    # グループの添字 + 割合は全体で単調増加なので、全グループの分位点を二分探索でまとめて求める
+    position = codes + share
+    result = np.full((size, len(quantiles)), np.nan)
+    nonempty = counts > 0
+    starts = np.arange(size)[nonempty]
+    for column, q in enumerate(quantiles):
+        found = np.searchsorted(position, starts + q, side="left" if q > 0 else "right")
+        result[nonempty, column] = values[np.minimum(found, len(values) - 1)]
+    shape = groups.shape if groups is not None else ()
+    return result.reshape(shape + (len(quantiles),))
+
+
+def weighted_shares(categories: np.ndarray, weights: np.ndarray, groups: Groups = None) -> tuple:
+    """
+    ウェイト付きの構成比（グループごとに、カテゴリーの値ごとのウェイトの割合）
+    戻り値は(カテゴリーの値, グループの形 + (カテゴリーの数,)の構成比)
+    """
+    weights = _weights(weights)
+    category = group({"category": categories})
+    valid = ~np.isnan(weights) & (weights >= 0)
+    codes = groups.codes if groups is not None else np.zeros(len(weights), dtype=np.int64)
+    size = groups.size if groups is not None else 1
+    cells = codes[valid] * len(category.keys[0]) + category.codes[valid]
+    totals = np.bincount(cells, weights=weights[valid], minlength=size * len(category.keys[0]))
+    totals = totals.reshape(size, len(category.keys[0]))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        shares = totals / totals.sum(axis=1, keepdims=True)
+    shape = groups.shape if groups is not None else ()
+    return category.keys[0], shares.reshape(shape + (len(category.keys[0]),))
+
+
+def load_columns(fields: tuple, survey_numbers: list = None, batch_size: int = 100000) -> dict:
+    """
+    answers_factから指定した属性の列をNumPyの配列で読み込む（NULLはNaN）
+    """
+    statement = select(*[getattr(Answer, field) for field in fields])
+    if survey_numbers:
+        statement = statement.where(Answer.survey_number.in_(survey_numbers))
+    chunks = []
+    with Engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(statement)
+        for rows in result.partitions():
+            chunks.append(np.array(rows, dtype=np.float64).reshape(len(rows), len(fields)))
+    values = np.concatenate(chunks) if chunks else np.zeros((0, len(fields)))
+    return {field: values[:, index] for index, field in enumerate(fields)}
+
+
+class IncomeSummary(NamedTuple):
+    """
+    次元の組ごとのウェイト付きの主な仕事の年収（年収0は未回答として除く）
+    """
+    groups: Groups
+    population: np.ndarray
+    mean: np.ndarray
+    quantiles: np.ndarray
+
+
+def income_by(dimensions: tuple, survey_numbers: list = None, quantiles=(0.25, 0.5, 0.75)) -> IncomeSummary:
+    """
+    次元の組（例えば("survey_number", "industry")）ごとのウェイト付きの年収の平均と分位点
+    """
+    columns = load_columns((*dimensions, "main_job_income", "weight"), survey_numbers)
+    groups = group({dimension: columns[dimension] for dimension in dimensions})
+    income = np.where(columns["main_job_income"] > 0, columns["main_job_income"], np.nan)
+    weights = columns["weight"]
+    return IncomeSummary(groups, weighted_total(weights, groups), weighted_mean(income, weights, groups),
+                         weighted_quantiles(income, weights, quantiles, groups))
@@ -0,0 +1,278 @@
+import io
+import struct
+import numpy as np
+from sqlalchemy import BigInteger, Boolean, Float, Integer, column, insert, table
+
+from migrate import Answer, AnswerResponse
+
+# CSVの列から変換する属性
+SOURCE_FIELDS = (
+    "answer_key",
+    "user_ID",
+    "age",
+    "gender",
+    "educational_attainment",
+    "main_job_income",
+    "industry",
+    "company_size",
+    "occupation",
+    "degree",
+    "self_learning",
+    "place_of_residence",
+    "has_spouse",
+    "has_children",
+    "children_count",
+    "major",
+    "working_situation",
+    "working_status",
+    "employment_status",
+    "leaving_count",
+    "weight",
+)
+
+# ロード時に他の属性から求める属性
+DERIVED_FIELDS = (
+    "age_class",
+)
+
+# マッピング済みの行タプルの並び（Answerの属性名）
+ANSWER_FIELDS = ("survey_number", *SOURCE_FIELDS, *DERIVED_FIELDS)
+
+# 属性名に対応するDBのカラム
+ANSWER_COLUMNS = tuple(Answer.__mapper__.get_property(field).columns[0] for field in ANSWER_FIELDS)
+SOURCE_COLUMNS = ANSWER_COLUMNS[1:1 + len(SOURCE_FIELDS)]
+
+
+def _numpy_type(column) -> str:
+    # カラムの型に対応するビッグエンディアンのNumPyの型（バイナリ形式のCOPYの値の並びと同じ）
+    if isinstance(column.type, BigInteger):
+        return ">i8"
+    if isinstance(column.type, Boolean):
+        return "?"
+    if isinstance(column.type, Integer):
+        return ">i4"
+    if isinstance(column.type, Float):
+        return ">f8"
+    raise TypeError("unsupported column type for binary COPY: %s" % column.name)
+
+
+def frame_columns(frame) -> list:
+    # DataFrameの列ごとの（値のNumPy配列、欠損のマスク）。欠損の位置の値は0
+    columns = []
+    for field, column in zip(ANSWER_FIELDS, ANSWER_COLUMNS):
+        values = frame[field]
+        columns.append((values.to_numpy(dtype=_numpy_type(column), na_value=0), values.isna().to_numpy()))
+    return columns
+
+
+def frame_rows(frame) -> list:
+    # DataFrameをPythonの値（欠損はNone）の行タプルに変換（列ごとにまとめてPythonの値にする）
+    columns = []
+    for values, null in frame_columns(frame):
+        values = values.tolist()
+        for index in np.flatnonzero(null).tolist():
+            values[index] = None
+        columns.append(values)
+    return list(zip(*columns))
+
+
+class OrmWriter:
+    """
+    bulk_insert_mappingsによる書き込み（従来の経路）
+    """
+
+    def __init__(self, session, table_name: str = None):
+        self.session = session
+        self.target = None
+        if table_name is not None:
+            # answers_fact以外（ステージングテーブルなど）へはCoreのINSERTで書き込む
+            self.target = table(table_name, *[column(answer_column.name) for answer_column in ANSWER_COLUMNS])
+
+    def write(self, rows: list) -> None:
+        if self.target is None:
+            self.session.bulk_insert_mappings(Answer, [dict(zip(ANSWER_FIELDS, row)) for row in rows])
+        else:
+            names = [answer_column.name for answer_column in ANSWER_COLUMNS]
+            self.session.execute(insert(self.target), [dict(zip(names, row)) for row in rows])
+
+    def write_frame(self, frame) -> None:
+        # 行タプルは列ごとにまとめて作る（行ごとに値を変換しない）
+        self.write(frame_rows(frame))
+
+
+class _RowStream(io.RawIOBase):
+    """
+    エンコード済みの行を順に読み出すファイルライクオブジェクト
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.pending:
+            self.pending = next(self.chunks, None)
+            if self.pending is None:
+                self.pending = b""
+                return 0
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+class _CopyWriter:
+    """
+    psycopg2のcopy_expertでanswers_factへ流し込む書き込みの基底クラス
+    """
+    FORMAT = None
+
+    def __init__(self, session, table_name: str = None):
+        self.session = session
+        columns = ", ".join(answer_column.name for answer_column in ANSWER_COLUMNS)
+        self.sql = "COPY %s (%s) FROM STDIN WITH (FORMAT %s)" % (table_name or Answer.__tablename__, columns,
+                                                                 self.FORMAT)
+
+    def encode(self, rows):
+        raise NotImplementedError
+
+    def write(self, rows: list) -> None:
+        self.copy(io.BufferedReader(_RowStream(self.encode(rows)), 1 << 16))
+
+    def write_frame(self, frame) -> None:
+        self.write(frame_rows(frame))
+
+    def copy(self, file) -> None:
+        # セッションと同じトランザクション上でCOPYを実行する
+        cursor = self.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(self.sql, file)
+        finally:
+            cursor.close()
+
+
+def _text_encoder(column):
+    if isinstance(column.type, Boolean):
+        return lambda value: "t" if value else "f"
+    return str
+
+
+class CopyTextWriter(_CopyWriter):
+    """
+    テキスト形式のCOPY
+    """
+    FORMAT = "text"
+
+    def __init__(self, session, table_name: str = None):
+        super().__init__(session, table_name)
+        self.encoders = tuple(_text_encoder(column) for column in ANSWER_COLUMNS)
+
+    def encode(self, rows):
+        encoders = self.encoders
+        for row in rows:
+            line = "\t".join("\\N" if value is None else encode(value) for encode, value in zip(encoders, row))
+            yield (line + "\n").encode("utf-8")
+
+    def write_frame(self, frame) -> None:
+        # 行タプルを経由せずDataFrameからそのままテキスト形式に書き出す
+        buffer = io.StringIO()
+        frame.to_csv(buffer, sep="\t", header=False, index=False, na_rep="\\N")
+        buffer.seek(0)
+        self.copy(buffer)
+
+
+_NULL = struct.pack(">i", -1)
+
+
+# NumPyの型に対応するstructの書式
+_STRUCT_CODES = {">i8": "q", "?": "?", ">i4": "i", ">f8": "d"}
+
+
+def _binary_encoder(column):
+    numpy_type = _numpy_type(column)
+    return struct.Struct(">i" + _STRUCT_CODES[numpy_type]), np.dtype(numpy_type).itemsize
+
+
+class CopyBinaryWriter(_CopyWriter):
+    """
+    バイナリ形式のCOPY
+    """
+    FORMAT = "binary"
+    HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+    TRAILER = struct.pack(">h", -1)
+
+    def __init__(self, session, table_name: str = None):
+        super().__init__(session, table_name)
+        self.encoders = tuple(_binary_encoder(column) for column in ANSWER_COLUMNS)
+        self.field_count = struct.pack(">h", len(ANSWER_COLUMNS))
+        # 1行分の並び（フィールド数、カラムごとの長さと値）
+        self.record = np.dtype([("count", ">i2"), *[
+            field for index, column in enumerate(ANSWER_COLUMNS)
+            for field in (("length%d" % index, ">i4"), ("value%d" % index, _numpy_type(column)))
+        ]])
+
+    def encode(self, rows):
+        encoders = self.encoders
+        yield self.HEADER
+        for row in rows:
+            fields = [self.field_count]
+            for (encoder, size), value in zip(encoders, row):
+                fields.append(_NULL if value is None else encoder.pack(size, value))
+            yield b"".join(fields)
+        yield self.TRAILER
+
+    def encode_frame(self, frame) -> bytes:
+        """
+        DataFrameを列ごとにまとめてバイナリ形式にする（行タプルを経由しない）
+        NULLは長さを-1にし、値のバイトは取り除く
+        """
+        size = len(frame)
+        record = np.empty(size, dtype=self.record)
+        record["count"] = len(ANSWER_COLUMNS)
+        keep = None
+        for index, (values, null) in enumerate(frame_columns(frame)):
+            name = "value%d" % index
+            width = self.record.fields[name][0].itemsize
+            record[name] = values
+            record["length%d" % index] = np.where(null, -1, width)
+            if null.any():
+                if keep is None:
+                    keep = np.ones((size, self.record.itemsize), dtype=bool)
+                offset = self.record.fields[name][1]
+                keep[null, offset:offset + width] = False
+        data = record.view(np.uint8).reshape(size, self.record.itemsize)
+        return self.HEADER + (data[keep] if keep is not None else data).tobytes() + self.TRAILER
+
+    def write_frame(self, frame) -> None:
+        self.copy(io.BytesIO(self.encode_frame(frame)))
+
+
+class ResponseWriter(_CopyWriter):
+    """
+    回答ごとの全設問の値（マッピング済みの行タプルの最後の要素）をanswer_responsesへテキスト形式のCOPYで書き込む
+    """
+    FORMAT = "text"
+
+    def __init__(self, session, table_name: str = None):
+        self.session = session
+        self.sql = "COPY %s (survey_number, answer_key, responses) FROM STDIN WITH (FORMAT text)" \
+                   % (table_name or AnswerResponse.__tablename__)
+
+    def encode(self, rows):
+        answer_key = ANSWER_FIELDS.index("answer_key")
+        for row in rows:
+            # answer_keyは主キーなので、回答キーが空欄の回答の全設問の値は保存しない
+            if row[answer_key] is None:
+                continue
+            responses = ",".join("NULL" if value is None else str(value) for value in row[-1])
+            yield ("%d\t%d\t{%s}\n" % (row[0], row[answer_key], responses)).encode("utf-8")
+
+
+WRITERS = {
+    "orm": OrmWriter,
+    "copy_text": CopyTextWriter,
+    "copy_binary": CopyBinaryWriter,
+}